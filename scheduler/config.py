@@ -1,6 +1,52 @@
+import json
 import os
 import itertools
 
+from scheduler import logger
+
+log = logger.get_logger()
+
+PRODUCT_TYPES = ['landsat', 'modis', 'viirs', 'plot']
+
+# values that can be changed in a running scheduler, from the config_file: name -> (type, minimum)
+TUNABLES = {'max_cpu':                   (int,   0),
+            'max_cpu_floor':             (int,   0),
+            'max_cpu_ceiling':           (int,   0),
+            'max_cpu_step':              (int,   1),
+            'max_cpu_hold_seconds':      (int,   0),
+            'max_cpu_peak_ceiling':      (int,   0),
+            'task_cpu':                  (float, 0),
+            'task_mem':                  (int,   0),
+            'task_disk':                 (int,   0),
+            'task_batch_size':           (int,   1),
+            'offer_refuse_seconds':      (int,   0),
+            'product_request_count':     (int,   1),
+            'product_request_frequency': (int,   1),
+            'product_scheduled_max':     (int,   0),
+            'priority_starvation_seconds': (int, 0),
+            'handle_orders_frequency':   (int,   1),
+            'handle_orders_debounce':    (int,   0),
+            'handle_orders_min_seconds': (int,   0),
+            'handle_orders_rate_seconds': (int,  0),
+            'handle_orders_bucket':      (int,   1),
+            'handle_orders_burst':       (int,   1),
+            'task_retry_max':            (int,   0),
+            'task_retry_backoff':        (int,   0),
+            'placement_warm_seconds':    (int,   0),
+            'placement_cold_hold':       (int,   0),
+            'agent_failure_window':      (int,   1),
+            'agent_failure_max':         (int,   1),
+            'agent_failure_rate':        (float, 0),
+            'agent_quarantine_seconds':  (int,   0),
+            'dedup_grace_seconds':       (int,   0),
+            'drain_batch_size':          (int,   1),
+            'drain_timeout_seconds':     (int,   0),
+            'lifecycle_report_seconds':  (int,   1),
+            'api_failure_threshold':     (int,   1),
+            'api_reset_seconds':         (int,   1),
+            'api_slow_seconds':          (int,   1),
+            'api_timeout_seconds':       (int,   1)}
+
 def default_env(variable, value, operator=None):
     default = [variable, value]
     upcase_variable = variable.upper()
@@ -11,13 +57,14 @@ def default_env(variable, value, operator=None):
         default = [variable, new_var]
     return default
 
-def product_frequency():
+def product_frequency(weights=None):
     de = default_env
+    weights = weights or {}
     frequency = []
-    frequency.append(['landsat', de('landsat_frequency', 3, int)[1]])
-    frequency.append(['modis',   de('modis_frequency',   2, int)[1]])
-    frequency.append(['viirs',   de('viirs_frequency',   1, int)[1]])
-    frequency.append(['plot',    de('plot_frequency',    1, int)[1]])
+    frequency.append(['landsat', weights.get('landsat_frequency', de('landsat_frequency', 3, int)[1])])
+    frequency.append(['modis',   weights.get('modis_frequency',   de('modis_frequency',   2, int)[1])])
+    frequency.append(['viirs',   weights.get('viirs_frequency',   de('viirs_frequency',   1, int)[1])])
+    frequency.append(['plot',    weights.get('plot_frequency',    de('plot_frequency',    1, int)[1])])
     return list(itertools.chain.from_iterable(itertools.repeat(x[0], x[1]) for x in frequency))
 
 def config():
@@ -27,25 +74,176 @@ def config():
         de('mesos_secret', None),
         de('mesos_master', None),
         de('mesos_user', 'espa'),
+        de('mesos_failover_timeout', 3600, int), # seconds, only used with a zookeeper standby
+        de('zookeeper', None), # e.g. zk1:2181,zk2:2181, enables coordination between instances
+        de('zookeeper_path', '/espa-scheduler'),
+        de('ha_mode', 'standby'), # standby or partition
         ['product_frequency', product_frequency()],
         de('espa_api', 'http://localhost:9876/production-api/v0'),
+        de('espa_api_concurrency', 16, int),
+        de('api_failure_threshold', 5, int), # consecutive failures before the circuit opens
+        de('api_reset_seconds', 30, int),
+        de('api_slow_seconds', 10, int),
+        de('api_timeout_seconds', 30, int),
         de('product_request_count', 50, int),
         de('product_request_frequency', 2, int),
         de('product_scheduled_max', 200, int),
+        de('product_priorities', None, lambda x: x.split(',')), # e.g. high,normal,low, requested in order
+        de('priority_starvation_seconds', 600, int),
+        de('fair_share_weights', None), # e.g. foo@umb.edu:2,bar@usgs.gov:0.5, users not listed weigh 1
+        de('drain_batch_size', 50, int), # units returned to ESPA concurrently when draining
+        de('drain_timeout_seconds', 300, int), # wait for launched tasks to finish when shutting down
+        de('dedup_grace_seconds', 900, int),
+        de('dedup_max_entries', 100000, int),
+        de('lifecycle_trace_size', 10000, int), # completed units kept for export
+        de('lifecycle_report_seconds', 300, int),
+        de('lifecycle_trace_file', None), # .json or .csv, written every lifecycle_report_seconds
         de('max_cpu', 10, int),
+        de('max_cpu_floor', 0, int), # 0 uses max_cpu
+        de('max_cpu_ceiling', 0, int), # above the floor enables the elastic cpu cap
+        de('max_cpu_step', 2, int),
+        de('max_cpu_hold_seconds', 300, int),
+        de('max_cpu_peak_hours', None), # e.g. 8-18, local time
+        de('max_cpu_peak_ceiling', 0, int), # 0 keeps max_cpu_ceiling during peak hours
         de('task_cpu', 1, float),
         de('task_mem', 5120, int), # 5G
         de('task_disk', 10240, int), # 10g
         de('task_image', None),
+        de('task_batch_size', 1, int), # units per task, 1 disables batching
+        de('task_batch_types', ['plot', 'viirs'], lambda x: x.split(',')),
         de('offer_refuse_seconds', 30, int),
+        de('task_retry_max', 3, int),
+        de('task_retry_backoff', 30, int), # seconds, doubled on each retry
+        de('placement_warm_seconds', 3600, int),
+        de('placement_cold_hold', 10, int),
+        de('agent_failure_window', 600, int), # seconds
+        de('agent_failure_max', 5, int),
+        de('agent_failure_rate', 0.5, float),
+        de('agent_quarantine_seconds', 600, int), # doubled on each quarantine
         de('auxiliary_mount', None),
         de('aux_dir', None), # name required by processing libs
         de('storage_mount', None),
         de('espa_storage', None), # name required by processing libs
         de('aster_ged_server_name', None),
-        de('handle_orders_frequency', 7, int),
+        de('handle_orders_frequency', 30, int), # minutes, fallback for the calls made as orders finish
+        de('handle_orders_debounce', 10, int), # seconds to wait for more finished units before calling
+        de('handle_orders_min_seconds', 30, int), # min seconds between calls made as orders finish
+        de('handle_orders_rate_seconds', 420, int), # calls average at most one per this many seconds
+        de('handle_orders_bucket', 3, int), # calls that can be made in a burst, within the average
+        de('handle_orders_burst', 20, int), # units finished that trigger a call, without an order finishing
         de('log_level', 'debug'),
         de('urs_machine', 'machine'), # these urs_* values provide auth to nasa earthdata
         de('urs_login', 'login'),
-        de('urs_password', 'password')
+        de('urs_password', 'password'),
+        de('config_file', None), # JSON file of TUNABLES and *_frequency values, reloaded on SIGHUP or change
+        de('config_watch_seconds', 30, int)
     ])
+
+def validate(cfg):
+    """
+    Check and convert the types of the tunable values in a config
+
+    Returns: cfg, raises ValueError on an invalid value
+    """
+    for key, (kind, minimum) in TUNABLES.items():
+        try:
+            value = kind(cfg.get(key))
+        except (TypeError, ValueError):
+            raise ValueError("{} must be a {}, got: {}".format(key, kind.__name__, cfg.get(key)))
+        if value < minimum:
+            raise ValueError("{} must be at least {}, got: {}".format(key, minimum, value))
+        cfg[key] = value
+
+    if not cfg.get('product_frequency'):
+        raise ValueError("at least one product type frequency must be above 0")
+    return cfg
+
+def load(path=None):
+    """
+    Build a validated config from the environment, overridden by the values in a JSON config file
+
+    Args:
+        path: JSON config file, defaults to the config_file setting
+
+    Returns: config dict, raises ValueError or OSError if the file can't be used
+    """
+    cfg = config()
+    path = path or cfg.get('config_file')
+    if not path:
+        return validate(cfg)
+
+    with open(path) as f:
+        overrides = json.load(f)
+
+    frequency_keys = ['{}_frequency'.format(p) for p in PRODUCT_TYPES]
+    unknown = sorted(set(overrides) - set(TUNABLES) - set(frequency_keys))
+    if unknown:
+        raise ValueError("can't be set in {}: {}".format(path, unknown))
+
+    weights = {}
+    for key in frequency_keys:
+        if key in overrides:
+            if not isinstance(overrides[key], int) or overrides[key] < 0:
+                raise ValueError("{} must be an int of at least 0, got: {}".format(key, overrides[key]))
+            weights[key] = overrides.pop(key)
+
+    cfg.update(overrides)
+    cfg['product_frequency'] = product_frequency(weights)
+    return validate(cfg)
+
+def diff(old, new):
+    """Return dict of key -> (old value, new value) for the values that differ"""
+    return {k: (old.get(k), new.get(k)) for k in sorted(set(old) | set(new)) if old.get(k) != new.get(k)}
+
+
+class Settings(object):
+    """
+    The current config snapshot. reload() builds and validates a new snapshot, then
+    swaps it in whole and passes it to the subscribers
+    """
+    def __init__(self, path=None):
+        self.current   = load(path)
+        self.path      = path or self.current.get('config_file')
+        self.listeners = []
+        self.mtime     = self._mtime()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            return None
+
+    def subscribe(self, listener):
+        """Call listener with the new config after each reload that changes something"""
+        self.listeners.append(listener)
+
+    def changed_on_disk(self):
+        return self._mtime() != self.mtime
+
+    def reload(self):
+        """
+        Reload the config, keeping the current one if the new one is invalid
+
+        Returns: dict of changes, see diff()
+        """
+        self.mtime = self._mtime()
+        try:
+            new = load(self.path)
+        except (OSError, ValueError) as e:
+            log.error("Config reload failed, keeping current config. error: {}".format(e))
+            return {}
+
+        changes = diff(self.current, new)
+        if not changes:
+            log.info("Config reloaded, no changes")
+            return changes
+
+        self.current = new
+        log.warning("Config reloaded, changes: {}".format(
+                    ', '.join('{}: {} -> {}'.format(k, old, value) for k, (old, value) in changes.items())))
+        for listener in self.listeners:
+            try:
+                listener(new)
+            except Exception as e:
+                log.error("Error applying reloaded config in {}, error: {}".format(listener, e))
+        return changes
@@ -0,0 +1,107 @@
+"""
+ZooKeeper coordination between espa-scheduler instances.
+
+In 'standby' mode instances hold a leader election, and only the leader runs.
+The Mesos framework id is kept in ZooKeeper so a new leader re-subscribes as the
+same framework and keeps its running tasks.
+
+In 'partition' mode every instance runs, and the product types requested from
+ESPA are split between the live instances.
+"""
+import os
+import socket
+
+from kazoo.client import KazooClient, KazooState
+from kazoo.exceptions import NoNodeError
+
+from scheduler import logger
+
+log = logger.get_logger()
+
+STANDBY   = 'standby'
+PARTITION = 'partition'
+
+def partition(products, members, member):
+    """
+    Split product types between members, round robin in sorted order
+
+    Args:
+        products: product frequency list, product types may repeat
+        members: list of member ids
+        member: id of the member to return product types for
+
+    Returns: products assigned to member, keeping their frequency
+    """
+    if member not in members:
+        return []
+    members = sorted(members)
+    types = sorted(set(products))
+    mine = [t for i, t in enumerate(types) if members[i % len(members)] == member]
+    return [p for p in products if p in mine]
+
+
+class Coordinator(object):
+
+    def __init__(self, hosts, path, identifier=None, client=None):
+        self.path       = path.rstrip('/')
+        self.identifier = identifier or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.client     = client or KazooClient(hosts=hosts)
+        self.member     = None
+
+    def start(self):
+        self.client.start()
+        self.client.ensure_path(self.path)
+
+    def stop(self):
+        self.client.stop()
+        self.client.close()
+
+    def on_lost(self, callback):
+        """Call callback if the ZooKeeper session is lost, along with leadership and membership"""
+        def listener(state):
+            if state == KazooState.LOST:
+                log.error("ZooKeeper session lost")
+                callback()
+        self.client.add_listener(listener)
+
+    def run_as_leader(self, fn, *args, **kwargs):
+        """Block until this instance is elected leader, then run fn"""
+        log.info("Waiting for leadership as {}".format(self.identifier))
+        election = self.client.Election('{}/election'.format(self.path), self.identifier)
+        return election.run(self._lead, fn, *args, **kwargs)
+
+    def _lead(self, fn, *args, **kwargs):
+        log.warning("Elected leader as {}".format(self.identifier))
+        return fn(*args, **kwargs)
+
+    def framework_id(self):
+        """Return the Mesos framework id stored in ZooKeeper, or None"""
+        try:
+            value, _ = self.client.get('{}/framework_id'.format(self.path))
+        except NoNodeError:
+            return None
+        return value.decode('utf-8') if value else None
+
+    def save_framework_id(self, framework_id):
+        path = '{}/framework_id'.format(self.path)
+        value = framework_id.encode('utf-8')
+        if self.client.exists(path):
+            self.client.set(path, value)
+        else:
+            self.client.create(path, value, makepath=True)
+        log.info("Saved Mesos framework id {}".format(framework_id))
+
+    def join(self):
+        """Register this instance as a live member for partitioning"""
+        self.member = self.client.create('{}/members/member-'.format(self.path), self.identifier.encode('utf-8'),
+                                         ephemeral=True, sequence=True, makepath=True)
+        self.member = self.member.rsplit('/', 1)[-1]
+        log.info("Joined as partition member {}".format(self.member))
+        return self.member
+
+    def members(self):
+        return self.client.get_children('{}/members'.format(self.path))
+
+    def assigned(self, products):
+        """Return the product types this member should request from ESPA"""
+        return partition(products, self.members(), self.member)
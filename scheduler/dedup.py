@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+from scheduler import logger
+
+log = logger.get_logger()
+
+QUEUED   = "queued"
+TASKED   = "tasked"
+RUNNING  = "running"
+FINISHED = "finished"
+
+def unit_key(unit):
+    return (unit.get('orderid'), unit.get('scene'))
+
+class UnitIndex(object):
+    """
+    Index of the units this scheduler holds, keyed by (orderid, scene), so the
+    same unit isn't queued or launched twice. Finished units are kept for a
+    grace window to catch late duplicates, and the index is capped in size
+    """
+    def __init__(self, grace_seconds, max_entries):
+        self.grace       = grace_seconds
+        self.max_entries = max_entries
+        self.units       = OrderedDict() # (orderid, scene) -> (state, last update), oldest update first
+        self.dropped     = {}            # state of the indexed unit -> duplicates dropped
+        self.open        = {}            # orderid -> units indexed and not finished
+        self.evicted_at  = None
+        self.lock        = threading.Lock()
+
+    def add(self, unit, now=None):
+        """
+        Index a newly fetched unit as queued
+
+        Args:
+            unit: work unit from ESPA
+
+        Returns: False if the unit is a duplicate and should be dropped
+        """
+        now = time.monotonic() if now is None else now
+        key = unit_key(unit)
+        with self.lock:
+            self._evict(now)
+            if key in self.units:
+                state = self.units[key][0]
+                self.dropped[state] = self.dropped.get(state, 0) + 1
+                log.warning("Dropping duplicate unit {}, already {}".format(key, state))
+                return False
+            self.units[key] = (QUEUED, now)
+            self._count(key, None, QUEUED)
+            return True
+
+    def update(self, key, state, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._count(key, self.state(key), state)
+            self.units[key] = (state, now)
+            self.units.move_to_end(key)
+
+    def remove(self, key):
+        """Forget a unit handed back to ESPA, so it's accepted if fetched again"""
+        with self.lock:
+            entry = self.units.pop(key, None)
+            if entry:
+                self._count(key, entry[0], None)
+
+    def state(self, key):
+        entry = self.units.get(key)
+        return entry[0] if entry else None
+
+    def open_units(self, orderid):
+        """Return the number of units of an order that are queued, tasked or running"""
+        return self.open.get(orderid, 0)
+
+    def _count(self, key, old, new):
+        change = (new not in (None, FINISHED)) - (old not in (None, FINISHED))
+        if change:
+            orderid = key[0]
+            self.open[orderid] = self.open.get(orderid, 0) + change
+            if self.open[orderid] <= 0:
+                del self.open[orderid]
+
+    def _evict(self, now):
+        # scanning for expired units once a second is plenty
+        if self.evicted_at is not None and now - self.evicted_at < 1 and len(self.units) <= self.max_entries:
+            return
+        self.evicted_at = now
+
+        for key, (state, updated) in list(self.units.items()):
+            if state == FINISHED and now - updated > self.grace:
+                del self.units[key]
+
+        # over capacity, drop finished units first, then the least recently updated
+        excess = len(self.units) - self.max_entries
+        if excess > 0:
+            finished = [k for k, (state, _) in self.units.items() if state == FINISHED][:excess]
+            for key in finished:
+                del self.units[key]
+            excess -= len(finished)
+        while excess > 0:
+            key, (state, _) = self.units.popitem(last=False)
+            self._count(key, state, None)
+            log.warning("Unit index full, evicting {} unit {}".format(state, key))
+            excess -= 1
+
+    def metrics(self):
+        """Return dict of indexed units per state, and duplicates dropped per state"""
+        with self.lock:
+            states = {}
+            for state, _ in self.units.values():
+                states[state] = states.get(state, 0) + 1
+            return {"units": states, "dropped": dict(self.dropped)}
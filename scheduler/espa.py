@@ -1,9 +1,14 @@
 import json
 from scheduler import logger
+from scheduler.metrics import Summary
 import requests
 import sys
+import threading
+import time
+from collections import OrderedDict
 
 from tenacity import retry
+from tenacity import retry_if_exception
 from tenacity import retry_if_exception_type
 from tenacity import stop_after_attempt
 from tenacity import wait_fixed
@@ -18,13 +23,126 @@ class APIException(Exception):
     pass
 
 
+class CircuitOpen(APIException):
+    """
+    Raised instead of calling the API while the circuit breaker is open
+    """
+    pass
+
+
+def not_circuit_open(e):
+    return not isinstance(e, CircuitOpen)
+
+
+class CircuitBreaker(object):
+    """
+    Stop calling the API after repeated failures or slow responses. Once open, a
+    single probe call is let through every reset_seconds (half-open), and the
+    circuit closes again when the probe succeeds. Calls started before the last
+    change of state don't move the circuit, so a slow call made while it was
+    closed can't close it again once it's open
+    """
+    CLOSED    = 'closed'
+    OPEN      = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30, slow_seconds=10):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds     = reset_seconds
+        self.slow_seconds      = slow_seconds
+        self.state             = self.CLOSED
+        self.failures          = 0    # consecutive
+        self.opened_at         = None
+        self.changed_at        = None
+        self.probing           = False
+        self.endpoints         = {}   # endpoint -> {calls, failures, latency}
+        self.lock              = threading.Lock()
+
+    def _transition(self, state, now):
+        if state != self.state:
+            log.warning("ESPA API circuit breaker {} -> {}".format(self.state, state))
+            self.state = state
+            self.changed_at = now
+
+    def available(self, now=None):
+        """Whether a call would be let through, without using up the half-open probe"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.state == self.OPEN:
+                return now - self.opened_at >= self.reset_seconds
+            if self.state == self.HALF_OPEN:
+                return not self.probing
+            return True
+
+    def allow(self, now=None):
+        """Whether to make a call now, taking the probe when half-open"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_seconds:
+                self._transition(self.HALF_OPEN, now)
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+                return True
+            return self.state == self.CLOSED
+
+    def record(self, endpoint, seconds, ok, now=None, started=None):
+        """
+        Record the outcome of a call, slow calls count as failures
+
+        Args:
+            endpoint: API resource called
+            seconds: latency of the call
+            ok: whether the API answered without a server or connection error
+            started: when the call was made, defaults to now - seconds
+        """
+        now = time.monotonic() if now is None else now
+        started = now - seconds if started is None else started
+        ok = ok and seconds <= self.slow_seconds
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {"calls": 0, "failures": 0, "latency": Summary()})
+            stats["calls"] += 1
+            stats["latency"].observe(seconds)
+            if not ok:
+                stats["failures"] += 1
+            # calls made before the last change of state, and any call while open, are only counted.
+            # Only the half-open probe can close an open circuit
+            if self.state == self.OPEN or (self.changed_at is not None and started < self.changed_at):
+                return
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self._transition(self.CLOSED, now)
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = now
+                self._transition(self.OPEN, now)
+
+    def metrics(self):
+        """Return breaker state, and calls, failures and latency quantiles per endpoint"""
+        with self.lock:
+            endpoints = {e: {"calls": s["calls"], "failures": s["failures"], "latency": s["latency"].snapshot()}
+                         for e, s in self.endpoints.items()}
+            return {"state": self.state, "endpoints": endpoints}
+
+
 class APIServer(object):
     """
     Simple class for a couple espa-api calls
     """
-    def __init__(self, base_url, image):
+    def __init__(self, base_url, image, breaker=None, max_deferred=10000, timeout=30):
         self.base = base_url
         self.image = image
+        self.breaker = breaker or CircuitBreaker()
+        # seconds to wait to connect and for a response, so a hung API fails and counts against the circuit
+        self.timeout = timeout
+        # status writes held back while the circuit is open, replayed by flush_deferred. Only the
+        # latest write per (orderid, scene) is kept, so a stale status is never replayed over a newer one
+        self.deferred = OrderedDict() # (orderid, scene) -> (call name, args)
+        self.max_deferred = max_deferred
+        self.deferred_lock = threading.Lock()
 
     def request(self, method, resource=None, status=None, **kwargs):
         """
@@ -49,10 +167,18 @@ class APIServer(object):
         else:
             url = self.base
 
+        endpoint = (resource or '/').split('?')[0]
+        if not self.breaker.allow():
+            raise CircuitOpen('ESPA API circuit open, not calling {}'.format(endpoint))
+
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
         try:
             resp = requests.request(method, url, **kwargs)
         except requests.RequestException as e:
+            self.breaker.record(endpoint, time.monotonic() - start, False, started=start)
             raise APIException(e)
+        self.breaker.record(endpoint, time.monotonic() - start, resp.status_code < 500, started=start)
 
         if status and resp.status_code != status:
             self._unexpected_status(resp.status_code, url)
@@ -76,8 +202,66 @@ class APIServer(object):
         if key in resp.keys():
             return resp[key]
 
-    @retry(stop=stop_after_attempt(2), wait=wait_fixed(10)) # 10 attempts, 60 second intervals
+    def available(self):
+        """Whether the API is taking calls. Fetching and launching new work should wait while it isn't"""
+        return self.breaker.available()
+
+    def _defer(self, name, *args):
+        key = (args[1], args[0])
+        log.info("ESPA API unavailable, deferring {} call: {}".format(name, args))
+        with self.deferred_lock:
+            self.deferred.pop(key, None)
+            self.deferred[key] = (name, args)
+            if len(self.deferred) > self.max_deferred:
+                _, oldest = self.deferred.popitem(last=False)
+                log.error("Deferred ESPA API writes full, dropping oldest: {}".format(oldest))
+        return {"response": None, "status": "deferred", "data": args}
+
+    def _supersede(self, prod_id, order_id):
+        # a write made now replaces any deferred write for the same unit
+        with self.deferred_lock:
+            self.deferred.pop((order_id, prod_id), None)
+
+    def flush_deferred(self):
+        """
+        Replay status writes deferred while the circuit was open
+
+        Returns: number of writes replayed
+        """
+        flushed = 0
+        while self.available():
+            with self.deferred_lock:
+                if not self.deferred:
+                    break
+                key, (name, args) = self.deferred.popitem(last=False)
+            try:
+                getattr(self, '_' + name)(*args)
+                flushed += 1
+            except CircuitOpen:
+                # keep it for the next flush, unless a newer write for the unit was deferred meanwhile
+                with self.deferred_lock:
+                    if key not in self.deferred:
+                        self.deferred[key] = (name, args)
+                        self.deferred.move_to_end(key, last=False)
+                break
+            except Exception as e:
+                log.error("Error replaying deferred {} call: {}, exception: {}".format(name, args, e))
+        if flushed:
+            log.info("Replayed {} deferred ESPA API writes, {} remaining".format(flushed, len(self.deferred)))
+        return flushed
+
     def update_status(self, prod_id, order_id, val):
+        """Update the status of a product, deferred while the API is unavailable"""
+        if not self.available():
+            return self._defer('update_status', prod_id, order_id, val)
+        self._supersede(prod_id, order_id)
+        try:
+            return self._update_status(prod_id, order_id, val)
+        except CircuitOpen:
+            return self._defer('update_status', prod_id, order_id, val)
+
+    @retry(stop=stop_after_attempt(2), wait=wait_fixed(10), retry=retry_if_exception(not_circuit_open)) # 10 attempts, 60 second intervals
+    def _update_status(self, prod_id, order_id, val):
         """
         Update the status of a product
 
@@ -108,8 +292,18 @@ class APIServer(object):
         self.update_status(prod_id, order_id, 'scheduled')
         return True
 
-    @retry(stop=stop_after_attempt(10), wait=wait_fixed(60)) # 10 attempts, 60 second intervals
     def set_scene_error(self, prod_id, order_id, data):
+        """Set a scene to error status, deferred while the API is unavailable"""
+        if not self.available():
+            return self._defer('set_scene_error', prod_id, order_id, data)
+        self._supersede(prod_id, order_id)
+        try:
+            return self._set_scene_error(prod_id, order_id, data)
+        except CircuitOpen:
+            return self._defer('set_scene_error', prod_id, order_id, data)
+
+    @retry(stop=stop_after_attempt(10), wait=wait_fixed(60), retry=retry_if_exception(not_circuit_open)) # 10 attempts, 60 second intervals
+    def _set_scene_error(self, prod_id, order_id, data):
         """
         Set a scene to error status
 
@@ -173,19 +367,27 @@ class APIServer(object):
 
         return status
 
-    def mesos_tasks_disabled(self):
-        resp = True
+    def mesos_tasks_enabled(self):
+        """
+        Read the run_mesos_tasks configuration
+
+        Returns: True if enabled, False if explicitly disabled, None if it couldn't be read
+        """
         try:
             run = self.get_configuration('run_mesos_tasks')
-            if run == 'True':
-                log.debug('Mesos tasks enabled in ESPA')
-                resp = False
-            else:
-                log.info("Mesos tasks disabled!")
         except Exception as e:
             log.error("Error retrieving run_mesos_tasks configuration, exception: {}".format(e))
+            return None
+
+        if run == 'True':
+            log.debug('Mesos tasks enabled in ESPA')
+            return True
+        log.info("Mesos tasks disabled!")
+        return False
 
-        return resp
+    def mesos_tasks_disabled(self):
+        """Whether new tasks shouldn't be launched, True when the configuration couldn't be read"""
+        return self.mesos_tasks_enabled() is not True
 
     @staticmethod
     def _unexpected_status(code, url):
@@ -220,6 +422,8 @@ def api_connect(params):
     """
     url = params.get('espa_api')
     image = params.get('task_image')
-    api = APIServer(url, image)
+    breaker = CircuitBreaker(params.get('api_failure_threshold', 5), params.get('api_reset_seconds', 30),
+                             params.get('api_slow_seconds', 10))
+    api = APIServer(url, image, breaker, timeout=params.get('api_timeout_seconds', 30))
     api.test_connection() # throws exception if non-200 response to base url
     return api
@@ -0,0 +1,85 @@
+"""
+Classify abnormal Mesos task states, and track retry attempts for work units
+that failed for reasons unrelated to the processing itself
+"""
+
+# http://mesos.apache.org/api/latest/java/org/apache/mesos/Protos.TaskState.html
+INFRASTRUCTURE_STATES = ["TASK_LOST", "TASK_DROPPED", "TASK_GONE", "TASK_GONE_BY_OPERATOR",
+                         "TASK_UNREACHABLE", "TASK_UNKNOWN"]
+
+# http://mesos.apache.org/api/latest/java/org/apache/mesos/Protos.TaskStatus.Reason.html
+INFRASTRUCTURE_REASONS = ["REASON_AGENT_DISCONNECTED", "REASON_AGENT_REMOVED", "REASON_AGENT_RESTARTED",
+                          "REASON_AGENT_UNKNOWN", "REASON_MASTER_DISCONNECTED", "REASON_CONTAINER_LAUNCH_FAILED",
+                          "REASON_CONTAINER_PREEMPTED", "REASON_EXECUTOR_REGISTRATION_TIMEOUT",
+                          "REASON_EXECUTOR_REREGISTRATION_TIMEOUT", "REASON_GC_ERROR", "REASON_INVALID_OFFERS",
+                          "REASON_RESOURCES_UNKNOWN", "REASON_TASK_UNKNOWN"]
+
+# infrastructure reasons that point at the agent the task ran on, rather than at Mesos or the network
+AGENT_REASONS = ["REASON_CONTAINER_LAUNCH_FAILED", "REASON_EXECUTOR_REGISTRATION_TIMEOUT",
+                 "REASON_EXECUTOR_REREGISTRATION_TIMEOUT", "REASON_GC_ERROR"]
+
+INFRASTRUCTURE = "infrastructure"
+PROCESSING     = "processing"
+
+def classify(update):
+    """
+    Decide whether an abnormal status update was caused by the cluster or by the processing
+
+    Args:
+        update: Mesos status update
+
+    Returns: INFRASTRUCTURE or PROCESSING
+    """
+    status = update.get('status', {})
+    if status.get('state') in INFRASTRUCTURE_STATES:
+        return INFRASTRUCTURE
+    if status.get('reason') in INFRASTRUCTURE_REASONS:
+        return INFRASTRUCTURE
+    return PROCESSING
+
+
+def agent_fault(update):
+    """
+    Decide whether an abnormal status update counts against the agent's health. A lost
+    or dropped task, or a master failover, says nothing about the agent it ran on
+
+    Args:
+        update: Mesos status update
+
+    Returns: True for processing failures, and failures with an agent side reason
+    """
+    if update.get('status', {}).get('reason') in AGENT_REASONS:
+        return True
+    return classify(update) == PROCESSING
+
+
+class RetryBudget(object):
+    """
+    Bounded number of retries per task, with exponential backoff between attempts
+    """
+    def __init__(self, max_retries, backoff_seconds, max_backoff_seconds=600):
+        self.max_retries  = max_retries
+        self.backoff      = backoff_seconds
+        self.max_backoff  = max_backoff_seconds
+        self.attempts     = {}
+
+    def allow(self, key):
+        """Return True if key has retries left"""
+        return self.attempts.get(key, 0) < self.max_retries
+
+    def record(self, key):
+        """
+        Count a retry for key
+
+        Args:
+            key: task id
+
+        Returns: number of seconds to wait before the retry
+        """
+        attempt = self.attempts.get(key, 0) + 1
+        self.attempts[key] = attempt
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def clear(self, key):
+        """Forget retries for key"""
+        self.attempts.pop(key, None)
@@ -0,0 +1,71 @@
+import re
+import threading
+
+# orderids start with the user's email, e.g. espa-foo@umb.edu-05232017-123456-789
+ORDER_USER = re.compile(r'^(?:espa-)?([^@]+@[^-]+)-')
+
+def user(orderid):
+    """Return the user an order belongs to, or the orderid if it doesn't name one"""
+    match = ORDER_USER.match(orderid or '')
+    return match.group(1) if match else orderid
+
+def parse_weights(value):
+    """
+    Parse user weights
+
+    Args:
+        value: comma separated user:weight pairs, e.g. 'foo@umb.edu:2,bar@usgs.gov:0.5'
+
+    Returns: dict of user -> weight
+    """
+    if not value:
+        return {}
+    weights = {}
+    for pair in value.split(','):
+        name, weight = pair.rsplit(':', 1)
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class FairShare(object):
+    """
+    Track the units each user and order has launched and not yet finished, to share
+    cluster slots with weighted max-min fairness. Each free slot goes to the user with
+    the smallest running share (units / weight), then to that user's order with the
+    fewest units running, so a large order can't hold every slot while others wait
+    """
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        self.users   = {} # user -> units running
+        self.orders  = {} # orderid -> units running
+        self.lock    = threading.Lock()
+
+    def weight(self, name):
+        return self.weights.get(name, 1.0)
+
+    def start(self, orderid, count=1):
+        with self.lock:
+            name = user(orderid)
+            self.users[name] = self.users.get(name, 0) + count
+            self.orders[orderid] = self.orders.get(orderid, 0) + count
+
+    def finish(self, orderid, count=1):
+        with self.lock:
+            name = user(orderid)
+            for running, key in ((self.users, name), (self.orders, orderid)):
+                running[key] = running.get(key, 0) - count
+                if running[key] <= 0:
+                    del running[key]
+
+    def share(self, name):
+        weight = self.weight(name)
+        return self.users.get(name, 0) / weight if weight > 0 else float('inf')
+
+    def rank(self, orderid):
+        """Return the sort key of an order, lowest is served first"""
+        return (self.share(user(orderid)), self.orders.get(orderid, 0))
+
+    def shares(self):
+        """Return dict of running units and weighted share per user"""
+        with self.lock:
+            return {name: {"running": count, "share": self.share(name)} for name, count in self.users.items()}
@@ -0,0 +1,126 @@
+import time
+from datetime import datetime
+
+def peak_hours(value):
+    """
+    Parse a peak hours range
+
+    Args:
+        value: 'start-end' in 24 hour local time, e.g. '8-18'. end may be before start to wrap midnight
+
+    Returns: set of peak hours
+    """
+    if not value:
+        return set()
+    start, end = [int(h) for h in value.split('-')]
+    if start <= end:
+        return set(range(start, end))
+    return set(range(start, 24)) | set(range(0, end))
+
+
+class CpuGovernor(object):
+    """
+    Move the effective CPU cap between a floor and a ceiling, following the backlog
+    of work and the unused capacity Mesos offers us. The ceiling can be lowered
+    during peak hours, to leave room for other frameworks. Changes smaller than
+    step, or within hold_seconds of the last change, are ignored so the cap doesn't flap
+    """
+    def __init__(self, cap, floor, ceiling, step=2, hold_seconds=300, peak=None, peak_ceiling=0, window_seconds=300):
+        self.floor        = floor
+        self.ceiling      = ceiling
+        self.step         = step
+        self.hold         = hold_seconds
+        self.peak         = peak or set()
+        self.peak_ceiling = peak_ceiling
+        self.window       = window_seconds
+        self.cap          = max(floor, min(cap, ceiling))
+        self.changed_at   = None
+        self.offered      = {}      # agent_id -> (time, unused cpus last offered)
+        self.backlog      = {}      # product_type -> (units fetched, whether the fetch was full)
+        self.explanation  = "starting at {} cpus".format(self.cap)
+
+    @property
+    def enabled(self):
+        return self.ceiling > self.floor
+
+    def observe_offers(self, agent_cpus, now=None):
+        """
+        Record the unused cpus in a batch of offers
+
+        Args:
+            agent_cpus: dict of agent_id -> cpus offered by that agent
+        """
+        now = time.monotonic() if now is None else now
+        for agent_id, cpus in agent_cpus.items():
+            self.offered[agent_id] = (now, cpus)
+        self._expire(now)
+
+    def _expire(self, now):
+        # an agent not offering again within the window has no spare cpus we know of
+        for agent_id in [a for a, (seen, _) in self.offered.items() if now - seen > self.window]:
+            del self.offered[agent_id]
+
+    def spare(self, now=None):
+        """Return the unused cpus last offered by each agent within the window, summed"""
+        self._expire(time.monotonic() if now is None else now)
+        return sum(cpus for _, cpus in self.offered.values())
+
+    def observe_fetch(self, product_type, count, limit):
+        """Record a request for products, a full response means ESPA has more waiting"""
+        self.backlog[product_type] = (count, count >= limit)
+
+    def ceiling_at(self, hour):
+        """Return the ceiling in effect at a local hour of the day"""
+        if hour in self.peak and self.peak_ceiling:
+            return min(self.ceiling, self.peak_ceiling)
+        return self.ceiling
+
+    def target(self, used, queued, task_cpu, hour, now=None):
+        """
+        Compute the cap wanted now
+
+        Args:
+            used: cpus used by launched tasks
+            queued: units waiting in the work list
+            task_cpu: cpus per task
+            hour: local hour of the day
+            now: monotonic time, for expiring old offers
+
+        Returns: tuple of target cap and the reasons for it
+        """
+        spare = self.spare(now)
+        waiting = [t for t, (_, full) in self.backlog.items() if full]
+        # a full response for a product type means at least that many more units are waiting in ESPA
+        more = sum(count for count, full in self.backlog.values() if full)
+        demand = used + (queued + more) * task_cpu
+        supply = used + spare
+
+        ceiling = self.ceiling_at(hour)
+        period = "peak" if hour in self.peak else "off-peak"
+        target = int(max(self.floor, min(demand, supply, ceiling)))
+        reasons = "{} cpus in use, {} units queued, ESPA backlog for {}, {:.0f} unused cpus offered, {} ceiling {}".format(
+                  used, queued, waiting or 'no product types', spare, period, ceiling)
+        return target, reasons
+
+    def adjust(self, used, queued, task_cpu, now=None, hour=None):
+        """
+        Move the cap toward the target, outside the hysteresis band
+
+        Returns: tuple of cap, and an explanation if it changed, else None
+        """
+        now  = time.monotonic() if now is None else now
+        hour = datetime.now().hour if hour is None else hour
+        target, reasons = self.target(used, queued, task_cpu, hour, now)
+
+        if target == self.cap:
+            return self.cap, None
+        # a cap outside the floor or ceiling is corrected right away, otherwise wait out the band and hold time
+        out_of_bounds = self.cap > self.ceiling_at(hour) or self.cap < self.floor
+        held = self.changed_at is not None and now - self.changed_at < self.hold
+        if not out_of_bounds and (abs(target - self.cap) < self.step or held):
+            return self.cap, None
+
+        self.explanation = "max cpu {} -> {}: {}".format(self.cap, target, reasons)
+        self.cap = target
+        self.changed_at = now
+        return self.cap, self.explanation
@@ -0,0 +1,86 @@
+import time
+from collections import deque
+
+from scheduler import logger
+
+log = logger.get_logger()
+
+class AgentHealth(object):
+    """
+    Track task outcomes per Mesos agent, and quarantine agents that fail too many
+    tasks. Each quarantine of the same agent lasts twice as long as the last one
+    """
+    def __init__(self, window_seconds, max_failures, failure_rate, quarantine_seconds, max_quarantine_seconds=86400):
+        self.window         = window_seconds
+        self.max_failures   = max_failures
+        self.failure_rate   = failure_rate
+        self.quarantine     = quarantine_seconds
+        self.max_quarantine = max_quarantine_seconds
+        self.outcomes       = {} # agent_id -> deque of (time, failed)
+        self.quarantines    = {} # agent_id -> number of times quarantined
+        self.excluded       = {} # agent_id -> quarantined until
+
+    def _record(self, agent_id, failed, now):
+        outcomes = self.outcomes.setdefault(agent_id, deque())
+        outcomes.append((now, failed))
+        while outcomes and now - outcomes[0][0] > self.window:
+            outcomes.popleft()
+        return outcomes
+
+    def record_success(self, agent_id, now=None):
+        now = time.monotonic() if now is None else now
+        self._record(agent_id, False, now)
+
+    def record_failure(self, agent_id, now=None):
+        """
+        Count a failed task against an agent, quarantining it if over the threshold
+
+        Args:
+            agent_id: mesos agent id
+
+        Returns: True if the agent was quarantined
+        """
+        now = time.monotonic() if now is None else now
+        outcomes = self._record(agent_id, True, now)
+        failures = sum(1 for _, failed in outcomes if failed)
+        total    = len(outcomes)
+
+        if failures < self.max_failures or failures < self.failure_rate * total:
+            return False
+        if self.is_excluded(agent_id, now):
+            return False
+
+        count = self.quarantines.get(agent_id, 0)
+        seconds = min(self.quarantine * 2 ** count, self.max_quarantine)
+        self.quarantines[agent_id] = count + 1
+        self.excluded[agent_id] = now + seconds
+        outcomes.clear()
+        log.warning("Quarantining agent {} for {} seconds after {} failed tasks of {} in the last {} seconds".format(
+                    agent_id, seconds, failures, total, self.window))
+        return True
+
+    def remaining(self, agent_id, now=None):
+        """Return seconds left in an agent's quarantine, 0 if it isn't excluded"""
+        now = time.monotonic() if now is None else now
+        until = self.excluded.get(agent_id)
+        if until is None:
+            return 0
+        if until <= now:
+            del self.excluded[agent_id]
+            log.info("Agent {} released from quarantine".format(agent_id))
+            return 0
+        return until - now
+
+    def is_excluded(self, agent_id, now=None):
+        return self.remaining(agent_id, now) > 0
+
+    def exclusions(self, now=None):
+        """Return dict of currently excluded agents, for operators"""
+        now = time.monotonic() if now is None else now
+        excluded = {}
+        for agent_id in list(self.excluded):
+            remaining = self.remaining(agent_id, now)
+            if remaining:
+                excluded[agent_id] = {"remaining_seconds": int(remaining),
+                                      "quarantines": self.quarantines.get(agent_id, 0)}
+        return excluded
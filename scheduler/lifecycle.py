@@ -0,0 +1,125 @@
+"""
+Unit lifecycle latency. Each unit's stages are timestamped with a monotonic clock,
+from being fetched from ESPA to its task finishing or failing. The time spent
+reaching each stage is summarised per product type, and completed units are kept
+in a fixed size trace for export
+"""
+import csv
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from scheduler.metrics import Summary
+
+FETCHED   = "fetched"
+SCHEDULED = "scheduled"
+TASKED    = "tasked"
+STAGING   = "staging"
+RUNNING   = "running"
+FINISHED  = "finished"
+FAILED    = "failed"
+TOTAL     = "total"
+
+STAGES = [FETCHED, SCHEDULED, TASKED, STAGING, RUNNING, FINISHED, FAILED]
+DONE   = (FINISHED, FAILED)
+
+class Lifecycle(object):
+    """
+    Track units by (orderid, scene). Marking a stage observes the seconds since the
+    unit's previous stage, under that stage and the unit's product type. Stages are
+    marked from both the event loop and the Mesos thread, so a mark for a stage the
+    unit has already passed is ignored. Reaching finished or failed also observes
+    the total since fetched, and moves the unit to the trace
+    """
+    def __init__(self, max_units=100000, trace_size=10000):
+        self.max_units = max_units
+        self.units     = OrderedDict() # (orderid, scene) -> dict of product_type and stage timestamps
+        self.trace     = deque(maxlen=trace_size)
+        self.latency   = {} # (product_type, stage) -> Summary
+        self.lock      = threading.Lock()
+
+    def mark(self, key, stage, product_type=None, now=None, rewind=False):
+        """
+        Record a unit reaching a stage
+
+        Args:
+            key: (orderid, scene)
+            stage: one of STAGES
+            product_type: product type, taken from the first mark of the unit
+            rewind: record the stage even if the unit has passed it, for a unit requeued after a failure
+
+        Returns: True if the stage was recorded
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            record = self.units.get(key)
+            if record is None:
+                record = self.units[key] = {"product_type": product_type, "stages": OrderedDict(),
+                                            "last": None, "furthest": -1}
+                while len(self.units) > self.max_units:
+                    self.units.popitem(last=False)
+            elif product_type and not record["product_type"]:
+                record["product_type"] = product_type
+
+            position = STAGES.index(stage)
+            if position <= record["furthest"] and not rewind:
+                return False
+            record["furthest"] = position
+
+            if record["last"] is not None:
+                self._observe(record["product_type"], stage, now - record["last"])
+            record["stages"][stage] = now
+            record["last"] = now
+
+            if stage in DONE:
+                del self.units[key]
+                first = next(iter(record["stages"].values()))
+                self._observe(record["product_type"], TOTAL, now - first)
+                self.trace.append(self._row(key, record))
+            return True
+
+    def forget(self, key):
+        """Stop tracking a unit that won't complete here"""
+        with self.lock:
+            self.units.pop(key, None)
+
+    def _observe(self, product_type, stage, seconds):
+        summary = self.latency.get((product_type, stage))
+        if summary is None:
+            summary = self.latency[(product_type, stage)] = Summary()
+        summary.observe(seconds)
+
+    def _row(self, key, record):
+        stages = record["stages"]
+        first  = next(iter(stages.values()))
+        row = {"orderid": key[0], "scene": key[1], "product_type": record["product_type"],
+               # wall clock time of the first stage, the stages are seconds after it
+               "started": round(time.time() - (time.monotonic() - first), 3)}
+        for stage in STAGES:
+            row[stage] = round(stages[stage] - first, 3) if stage in stages else None
+        return row
+
+    def summary(self):
+        """Return dict of product type -> stage -> count, p50, p95 and p99 seconds"""
+        with self.lock:
+            report = {}
+            for (product_type, stage), summary in self.latency.items():
+                report.setdefault(product_type or "unknown", {})[stage] = summary.snapshot()
+            return report
+
+    def in_flight(self):
+        return len(self.units)
+
+    def export(self, path):
+        """Write the trace of completed units to path, as JSON if it ends in .json, else CSV"""
+        with self.lock:
+            rows = list(self.trace)
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.json'):
+                json.dump(rows, f)
+            else:
+                writer = csv.DictWriter(f, fieldnames=["orderid", "scene", "product_type", "started"] + STAGES)
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
@@ -1,8 +1,5 @@
 import logging
 import sys
-from scheduler.config import config
-
-cfg = config()
 
 class LogFilter(object):
     def __init__(self, level):
@@ -12,7 +9,11 @@ class LogFilter(object):
         return logRecord.levelno <= self.__level
 
 def get_logger():
+    """Return the scheduler logger, without configuring it, so modules can call this on import"""
+    return logging.getLogger('scheduler')
 
+def configure(cfg):
+    """Set the scheduler logger's level and handlers from the config"""
     log_level = logging.DEBUG if cfg.get('log_level') == 'debug' else logging.INFO 
 
     formatter = logging.Formatter('%(asctime)-15s %(levelname)-9s - %(message)s')
@@ -1,93 +1,98 @@
 import addict
+import asyncio
+import json
+import math
 import os
-import schedule
+import requests
+import threading
+import time
+from collections import deque
 from mesoshttp.client import MesosClient
-from multiprocessing import Process, Queue
-from multiprocessing.queues import Empty, Full
+from queue import Empty
 
-from scheduler import config, espa, logger, task, util
+from scheduler import config, coordination, dedup, espa, failure, fairshare, governor, health, lifecycle, logger, placement, queues, runtime, task, util
 
 log = logger.get_logger()
 
-def get_products_to_process(cfg, espa, work_list):
-    max_scheduled = cfg.get('product_scheduled_max')
-    products      = cfg.get('product_frequency')
-    request_count = cfg.get('product_request_count')
-
-    if espa.mesos_tasks_disabled():
-        log.debug("mesos tasks disabled, not requesting products to process")
-        return True
-
-    # qsize() is approximate https://docs.python.org/3/library/multiprocessing.html#multiprocessing.Queue.qsize
-    if work_list.qsize() < max_scheduled:
-        # pull the first item off the product types list
-        product_type = products.pop(0)
-        # get products to process for the product_type
-        units = espa.get_products_to_process([product_type], request_count).get("products")
-        # put that product type at the back of the list
-        products.append(product_type)
-
-        # if units are emtpy...
-        if not units:
-            log.info("No work to do for product_type: {}".format(product_type))
-        else:
-            log.info("Work to do for product_type: {}, count: {}, appending to work list".format(product_type, len(units)))
-            for u in units:
-                try:
-                    # add the units of work to the workList
-                    work_list.put_nowait(u)
-                    # update retrieved products in espa to scheduled status
-                    espa.set_to_scheduled(u)
-                except Full:
-                    log.error("work_list queue is full!")
-                except Exception as e:
-                    log.error("problem scheduling a task! unit: {} \n error: {}".format(u, e))
-    else:
-        log.info("Max number of tasks scheduled, not requesting more products to process")
-        
-    return True
-
-def scheduled_tasks(cfg, espa_api, work_list):
-    product_frequency = cfg.get('product_request_frequency')
-    handler_frequency = cfg.get('handle_orders_frequency')
-    log.debug("calling get_products_to_process with frequency: {} minutes".format(product_frequency))
-    log.debug("calling handle_orders with frequency: {} minutes".format(handler_frequency))
-    schedule.every(product_frequency).minutes.do(get_products_to_process, cfg=cfg, espa=espa_api, work_list=work_list)
-    schedule.every(handler_frequency).minutes.do(espa_api.handle_orders)
-    while True:
-        schedule.run_pending()
- 
-
 class ESPAFramework(object):
 
-    def __init__(self, cfg, espa_api, worklist):
+    def __init__(self, cfg, espa_api, worklist, framework_id=None):
         master    = cfg.get('mesos_master') 
         principal = cfg.get('mesos_principal')
         secret    = cfg.get('mesos_secret')
 
         self.workList        = worklist
         self.runningList     = {}
-        self.max_cpus        = cfg.get('max_cpu')
-        self.required_cpus   = cfg.get('task_cpu')
-        self.required_memory = cfg.get('task_mem')
-        self.required_disk   = cfg.get('task_disk')
-        self.task_image      = cfg.get('task_image')
-        self.refuse_seconds  = cfg.get('offer_refuse_seconds')
-        self.request_count   = cfg.get('product_request_count')
-        self.products        = cfg.get('product_frequency')
+        self.taskedList      = {}
+        self.index           = dedup.UnitIndex(cfg.get('dedup_grace_seconds'), cfg.get('dedup_max_entries'))
+        self.retryList       = deque()
+        # retryList and taskedList change on the Mesos event thread and are drained from the event loop
+        self.lock            = threading.RLock()
+        self.retries         = failure.RetryBudget(cfg.get('task_retry_max'), cfg.get('task_retry_backoff'))
+        self.placement       = placement.PlacementScorer(cfg.get('placement_warm_seconds'), cfg.get('placement_cold_hold'))
+        self.agents          = health.AgentHealth(cfg.get('agent_failure_window'), cfg.get('agent_failure_max'),
+                                                  cfg.get('agent_failure_rate'), cfg.get('agent_quarantine_seconds'))
+        self.governor        = governor.CpuGovernor(cfg.get('max_cpu'), cfg.get('max_cpu'), cfg.get('max_cpu'))
+        self.fair            = fairshare.FairShare()
+        self.lifecycle       = lifecycle.Lifecycle(cfg.get('dedup_max_entries'), cfg.get('lifecycle_trace_size'))
+        self.products        = list(cfg.get('product_frequency'))
+        self.draining        = False # decline offers and hand units back to ESPA, while shutting down
+        self.on_units_done   = None # called with orderid, units done, and whether the order has any left
         self.healthy_states  = ["TASK_STAGING", "TASK_STARTING", "TASK_RUNNING", "TASK_FINISHED"]
         self.espa = espa_api
-        self.cfg  = cfg
+        self.reconfigure(cfg)
 
-        self.client = MesosClient(mesos_urls=[master], frameworkName='ESPA Mesos Framework')
+        self.framework_id = framework_id
+        self.client = MesosClient(mesos_urls=[master], frameworkId=framework_id, frameworkName='ESPA Mesos Framework')
         self.client.verify = False
         self.client.set_credentials(principal, secret)
         self.client.on(MesosClient.SUBSCRIBED, self.subscribed)
         self.client.on(MesosClient.OFFERS, self.offer_received)
         self.client.on(MesosClient.UPDATE, self.status_update)
+        # the work list is filled by the runtime, alongside subscribing
+        self.created_at = time.monotonic()
+        self.subscribed_at = None
 
-        # put some work on the queue
-        get_products_to_process(cfg, self.espa, self.workList)
+    def reconfigure(self, cfg):
+        """Pick up new tunable values, used from the next offer or status update on"""
+        self.cfg             = cfg
+        self.max_cpus        = cfg.get('max_cpu')
+        self.required_cpus   = cfg.get('task_cpu')
+        self.required_memory = cfg.get('task_mem')
+        self.required_disk   = cfg.get('task_disk')
+        self.batch_size      = cfg.get('task_batch_size')
+        self.batch_types     = cfg.get('task_batch_types')
+        self.task_image      = cfg.get('task_image')
+        self.refuse_seconds  = cfg.get('offer_refuse_seconds')
+        self.request_count   = cfg.get('product_request_count')
+
+        self.retries.max_retries    = cfg.get('task_retry_max')
+        self.retries.backoff        = cfg.get('task_retry_backoff')
+        self.placement.warm_seconds = cfg.get('placement_warm_seconds')
+        self.placement.cold_hold    = cfg.get('placement_cold_hold')
+        self.agents.window          = cfg.get('agent_failure_window')
+        self.agents.max_failures    = cfg.get('agent_failure_max')
+        self.agents.failure_rate    = cfg.get('agent_failure_rate')
+        self.agents.quarantine      = cfg.get('agent_quarantine_seconds')
+        self.index.grace            = cfg.get('dedup_grace_seconds')
+        self.fair.weights           = fairshare.parse_weights(cfg.get('fair_share_weights'))
+        if isinstance(self.workList, queues.LaneQueue):
+            self.workList.starvation = cfg.get('priority_starvation_seconds')
+            self.workList.fair       = self.fair
+
+        # the fixed max_cpu is the floor, and the ceiling too unless an elastic range is configured
+        self.governor.floor        = cfg.get('max_cpu_floor') or cfg.get('max_cpu')
+        self.governor.ceiling      = max(self.governor.floor, cfg.get('max_cpu_ceiling') or cfg.get('max_cpu'))
+        self.governor.step         = cfg.get('max_cpu_step')
+        self.governor.hold         = cfg.get('max_cpu_hold_seconds')
+        self.governor.peak         = governor.peak_hours(cfg.get('max_cpu_peak_hours'))
+        self.governor.peak_ceiling = cfg.get('max_cpu_peak_ceiling')
+        if self.governor.enabled:
+            self.max_cpus = self.governor.cap
+
+        # the product types list is rotated in place by the fetcher, only replace it when the weights change
+        if sorted(self.products) != sorted(cfg.get('product_frequency')):
+            self.products[:] = cfg.get('product_frequency')
 
     def _getResource(self, res, name):
         for r in res:
@@ -103,9 +108,150 @@ class ESPAFramework(object):
                 r['scalar']['value'] -= value
         return
 
+    def _next_work(self):
+        # units requeued after an infrastructure failure go first, once their backoff has passed
+        now = time.monotonic()
+        with self.lock:
+            for i, (ready_at, work) in enumerate(self.retryList):
+                if ready_at <= now:
+                    del self.retryList[i]
+                    return work
+            return self.workList.get(False) # will raise queue.Empty if no objects present
+
+    def _requeue(self, work):
+        key = (work.get('orderid'), work.get('scene'))
+        if not self.retries.allow(key):
+            return False
+
+        # decide under the lock, so a drain taking the queued units either sees the unit or returns it
+        with self.lock:
+            draining = self.draining
+            if not draining:
+                delay = self.retries.record(key)
+                self.retryList.appendleft((time.monotonic() + delay, work))
+                self.index.update(key, dedup.QUEUED)
+
+        if draining:
+            log.warning("infrastructure failure for: {} while draining, returning it to ESPA".format(key))
+            self.index.remove(key)
+            self.lifecycle.forget(key)
+            try:
+                self.espa.update_status(work.get('scene'), work.get('orderid'), 'submitted')
+            except Exception as e:
+                log.error("Error returning unit {} to submitted, exception: {}".format(key, e))
+            return True
+
+        log.warning("infrastructure failure for: {}, requeueing in {} seconds, attempt {} of {}".format(
+                    key, delay, self.retries.attempts[key], self.retries.max_retries))
+        self.lifecycle.mark(key, lifecycle.SCHEDULED, rewind=True)
+        try:
+            self.espa.update_status(work.get('scene'), work.get('orderid'), 'scheduled')
+        except Exception as e:
+            log.error("Error resetting requeued unit {} to scheduled, exception: {}".format(key, e))
+        return True
+
+    def _put_back(self, units):
+        # units taken but not launched go back to the front of their lane, not ahead of every lane
+        with self.lock:
+            if isinstance(self.workList, queues.LaneQueue):
+                for unit in reversed(units):
+                    self.workList.requeue(unit)
+            else:
+                self.retryList.extendleft((0, u) for u in reversed(units))
+
+    def _batch(self, work, mesos_offer):
+        # group further units of the same order and product type into one task, as many as
+        # the offer has disk left for after the first unit
+        units = [work]
+        if self.batch_size <= 1 or work.get('product_type') not in self.batch_types:
+            return units
+
+        resources = mesos_offer.get('resources', [])
+        room = self.batch_size
+        if self.required_disk:
+            room = int(self._getResource(resources, "disk") // self.required_disk)
+        limit = min(self.batch_size, 1 + room)
+
+        skipped = []
+        lookahead = self.batch_size * 4
+        while len(units) < limit and lookahead > 0:
+            lookahead -= 1
+            try:
+                unit = self._next_work()
+            except Empty:
+                break
+            if unit.get('orderid') == work.get('orderid') and unit.get('product_type') == work.get('product_type'):
+                units.append(unit)
+            else:
+                skipped.append(unit)
+
+        # put back what didn't fit the batch, ahead of the rest of the queue and in the same order
+        self._put_back(skipped)
+        self._updateResource(resources, "disk", self.required_disk * (len(units) - 1))
+        return units
+
+    def take_queued(self):
+        """Remove and return every unit waiting to be launched, retries included"""
+        with self.lock:
+            units = [work for _, work in self.retryList]
+            self.retryList.clear()
+            while True:
+                try:
+                    units.append(self.workList.get(False))
+                except Empty:
+                    return units
+
+    def start_draining(self):
+        """Stop launching tasks and retrying units, they're handed back to ESPA instead"""
+        with self.lock:
+            self.draining = True
+
+    def units_done(self, orderid, count):
+        if self.on_units_done:
+            self.on_units_done(orderid, count, self.index.open_units(orderid) == 0)
+
+    def agent_exclusions(self):
+        """Return dict of agents currently quarantined for failing tasks"""
+        return self.agents.exclusions()
+
     def subscribed(self, driver):
-        log.warning('SUBSCRIBED')
+        self.subscribed_at = time.monotonic()
+        log.warning('SUBSCRIBED {:.2f} seconds after start'.format(self.subscribed_at - self.created_at))
         self.driver = driver
+        if self.framework_id:
+            # taking over a framework, its tasks may still be running
+            self.reconcile(driver)
+
+    def reconcile(self, driver):
+        """
+        Ask Mesos for the state of every task of this framework (implicit reconciliation). The
+        answers arrive as status updates, and rebuild the tasked and running lists
+        """
+        # driver.reconcile() returns without a call when given no tasks, so send it directly
+        message = {"framework_id": {"value": driver.frameworkId},
+                   "type": "RECONCILE",
+                   "reconcile": {"tasks": []}}
+        headers = {'Content-Type': 'application/json',
+                   'Accept': 'application/json',
+                   'Mesos-Stream-Id': driver.streamId}
+        try:
+            requests.post(driver.mesos_url + '/api/v1/scheduler', json.dumps(message), headers=headers,
+                          auth=driver.requests_auth, verify=driver.verify)
+            log.warning("Requested reconciliation of tasks for framework {}".format(driver.frameworkId))
+        except Exception as e:
+            log.error("Error requesting task reconciliation, exception: {}".format(e))
+
+    def govern(self):
+        """Let the governor move the cpu cap, given the cpus in use and the work waiting"""
+        if not self.governor.enabled:
+            return self.max_cpus
+        used   = len(self.taskedList) * self.required_cpus
+        queued = self.workList.qsize() + len(self.retryList)
+        cap, explanation = self.governor.adjust(used, queued, self.required_cpus)
+        if explanation:
+            log.warning(explanation)
+        self.max_cpus = cap
+        return cap
 
     def core_limit_reached(self):
         running_count = len(self.runningList)
@@ -142,8 +288,10 @@ class ESPAFramework(object):
 
         return accept
 
-    def decline_offer(self, offer):
-        options = {'filters': {'refuse_seconds': self.refuse_seconds}}
+    def decline_offer(self, offer, refuse_seconds=None):
+        if refuse_seconds is None:
+            refuse_seconds = self.refuse_seconds
+        options = {'filters': {'refuse_seconds': refuse_seconds}}
         log.debug("declining offer: {} with options: {}".format(offer, options))
         try:
             offer.decline(options)
@@ -156,12 +304,21 @@ class ESPAFramework(object):
         response = addict.Dict()
         response.offers.length = len(offers)
         response.offers.accepted = 0
+        response.offers.quarantined = 0
         log.debug("Received {} new offers...".format(response.offers.length))
 
+        # back off while the ESPA API is failing, status writes for new tasks wouldn't go through
+        if not self.espa.available():
+            log.debug("ESPA API unavailable, declining {} offers".format(len(offers)))
+            for offer in offers:
+                self.decline_offer(offer)
+            response.tasks.enabled = False
+            return response
+
         # check to see if Mesos tasks are enabled
-        if self.espa.mesos_tasks_disabled():
+        if self.draining or self.espa.mesos_tasks_disabled():
             # decline the offers to free up the resources
-            log.debug("mesos tasks disabled, declining {} offers".format(len(offers)))
+            log.debug("mesos tasks disabled or draining, declining {} offers".format(len(offers)))
             for offer in offers:
                 self.decline_offer(offer)   
             response.tasks.enabled = False
@@ -169,6 +326,15 @@ class ESPAFramework(object):
         else:
             response.tasks.enabled = True
 
+        # offers are the cluster's unused capacity, which the governor follows
+        agent_cpus = {}
+        for o in offers:
+            offer = o.get_offer()
+            agent_id = offer.get('agent_id', {}).get('value')
+            agent_cpus[agent_id] = agent_cpus.get(agent_id, 0) + self._getResource(offer.get('resources', []), "cpus")
+        self.governor.observe_offers(agent_cpus)
+        self.govern()
+
         # check to see if core limit has been reached
         if self.core_limit_reached():
             # decline the offers to free up the resources
@@ -180,31 +346,63 @@ class ESPAFramework(object):
         else:
             response.tasks.enabled = True
 
+        candidates = []
         for offer in offers:
             mesos_offer = offer.get_offer()
-            if self.accept_offer(mesos_offer):
-                log.debug("Acceptable offer, checking for work to do")
-                try:
-                    work     = self.workList.get(False) # will raise multiprocessing.Empty if no objects present
-                    orderid  = work.get('orderid')
-                    scene    = work.get('scene')
-                    task_id  = "{}_@@@_{}".format(orderid, scene)
-                    new_task = task.build(task_id, mesos_offer, self.task_image, self.required_cpus, 
-                                          self.required_memory, self.required_disk, work, self.cfg)
-                    log.debug("New Task definition: {}".format(new_task))
-                    offer.accept([new_task])
-                    self.espa.update_status(scene, orderid, 'tasked')
-                    response.offers.accepted += 1
-                except Empty:
-                    log.debug("Work queue is empty, declining offer")
-                    self.decline_offer(offer)
-                except Exception as e:
-                    log.error("Exception creating new task. offer: {}, exception: {}\n declining offer".format(offer, e))
-                    self.decline_offer(offer)
+            quarantine  = self.agents.remaining(mesos_offer['agent_id']['value'])
+            if quarantine:
+                log.debug("Offer from quarantined agent, declining for {} seconds".format(math.ceil(quarantine)))
+                self.decline_offer(offer, math.ceil(quarantine))
+                response.offers.quarantined += 1
+            elif self.accept_offer(mesos_offer):
+                candidates.append(offer)
             else:
                 log.debug("Unacceptable offer, declining")
                 self.decline_offer(offer)
 
+        while candidates:
+            try:
+                work = self._next_work()
+            except Empty:
+                log.debug("Work queue is empty, declining {} offers".format(len(candidates)))
+                for offer in candidates:
+                    self.decline_offer(offer)
+                break
+
+            product_type = work.get('product_type')
+            offer, warm = self.placement.choose(candidates, self.task_image, product_type)
+            if offer is None:
+                log.debug("Holding back from {} cold agents, declining their offers".format(len(candidates)))
+                self._put_back([work])
+                for offer in candidates:
+                    self.decline_offer(offer, self.placement.cold_hold)
+                break
+
+            candidates.remove(offer)
+            log.debug("Acceptable offer, launching work. warm agent: {}".format(warm))
+            try:
+                mesos_offer = offer.get_offer()
+                units    = self._batch(work, mesos_offer)
+                orderid  = work.get('orderid')
+                attempt  = max(self.retries.attempts.get(dedup.unit_key(u), 0) for u in units)
+                task_id  = task.task_id(orderid, [u.get('scene') for u in units], attempt)
+                new_task = task.build(task_id, mesos_offer, self.task_image, self.required_cpus, 
+                                      self.required_memory, self.required_disk * len(units), units, self.cfg)
+                log.debug("New Task definition: {}".format(new_task))
+                offer.accept([new_task])
+                with self.lock:
+                    self.taskedList[task_id] = units
+                self.fair.start(orderid, len(units))
+                self.placement.launched(task_id, mesos_offer['agent_id']['value'], self.task_image, product_type, warm)
+                for unit in units:
+                    self.index.update(dedup.unit_key(unit), dedup.TASKED)
+                    self.lifecycle.mark(dedup.unit_key(unit), lifecycle.TASKED, unit.get('product_type'))
+                    self.espa.update_status(unit.get('scene'), orderid, 'tasked')
+                response.offers.accepted += 1
+            except Exception as e:
+                log.error("Exception creating new task. offer: {}, exception: {}\n declining offer".format(offer, e))
+                self.decline_offer(offer)
+
         log.debug("resourceOffer response: {}".format(response))
         return response
 
@@ -212,57 +410,144 @@ class ESPAFramework(object):
         # possible state values
         # http://mesos.apache.org/api/latest/java/org/apache/mesos/Protos.TaskState.html
         task_id = update['status']['task_id']['value']
-        orderid, scene = task_id.split("_@@@_")
+        orderid, scenes = task.decode_id(task_id)
         state = update['status']['state']
+        agent_id = update['status'].get('agent_id', {}).get('value')
 
         response = addict.Dict()
         response.task_id = task_id
         response.state = state
 
+        # an update for a launch that has since been retried, e.g. a repeated TASK_LOST or
+        # a task that reappeared, describes units now queued or running under a newer id
+        current = max(self.retries.attempts.get((orderid, scene), 0) for scene in scenes)
+        if task.decode_attempt(task_id) < current:
+            log.info("Ignoring {} update for {}, superseded by attempt {}".format(state, task_id, current))
+            response.status = "stale"
+            return response
+
         if state in self.healthy_states:
             log.debug("status update for: {}  new status: {}".format(task_id, state))
             response.status = "healthy"
 
+            with self.lock:
+                adopt = state != "TASK_FINISHED" and task_id not in self.taskedList
+                if adopt:
+                    self.taskedList[task_id] = [{"orderid": orderid, "scene": scene} for scene in scenes]
+            if adopt:
+                # a task launched before a restart or failover, reported by reconciliation
+                log.info("Adopting task {} in state {}".format(task_id, state))
+                self.fair.start(orderid, len(scenes))
+                for scene in scenes:
+                    self.index.update((orderid, scene), dedup.TASKED)
+
+            if state == "TASK_STAGING":
+                for scene in scenes:
+                    self.lifecycle.mark((orderid, scene), lifecycle.STAGING)
+
             if state == "TASK_RUNNING":
                 response.list.name = "running"
                 if task_id not in self.runningList:
                     self.runningList[task_id] = util.right_now()
+                    for scene in scenes:
+                        self.index.update((orderid, scene), dedup.RUNNING)
+                        self.lifecycle.mark((orderid, scene), lifecycle.RUNNING)
+                    self.placement.running(task_id)
                     response.list.status = "new"
                 else:
                     response.list.status = "current"
 
             if state == "TASK_FINISHED":
+                if agent_id:
+                    self.agents.record_success(agent_id)
+                for scene in scenes:
+                    self.retries.clear((orderid, scene))
+                    self.index.update((orderid, scene), dedup.FINISHED)
+                    self.lifecycle.mark((orderid, scene), lifecycle.FINISHED)
+                self.units_done(orderid, len(scenes))
+                with self.lock:
+                    units = self.taskedList.pop(task_id, None)
+                if units:
+                    self.fair.finish(orderid, len(units))
+                self.placement.forget(task_id)
                 try:
                     self.runningList.__delitem__(task_id)
                 except KeyError:
                     log.debug("Received TASK_FINISHED update for {}, which wasn't in the runningList".format(task_id))
 
         else: # something abnormal happened
-            log.error("abnormal task state for: {}, full update: {}".format(task_id, update))
-            response.status = "unhealthy"
-            self.espa.set_scene_error(scene, orderid, update)
+            response.failure = failure.classify(update)
+            if agent_id and failure.agent_fault(update) and self.agents.record_failure(agent_id):
+                log.warning("Excluded agents: {}".format(self.agent_exclusions()))
+            # units launched before a restart aren't known, so can only be set to error
+            with self.lock:
+                units = self.taskedList.pop(task_id, [])
+            if units:
+                self.fair.finish(orderid, len(units))
+            retried = []
+            if response.failure == failure.INFRASTRUCTURE:
+                retried = [u.get('scene') for u in units if self._requeue(u)]
+
+            failed = [s for s in scenes if s not in retried]
+            if failed:
+                log.error("abnormal task state for: {}, full update: {}".format(task_id, update))
+                response.status = "unhealthy"
+                for scene in failed:
+                    self.espa.set_scene_error(scene, orderid, update)
+                    self.retries.clear((orderid, scene))
+                    self.index.update((orderid, scene), dedup.FINISHED)
+                    self.lifecycle.mark((orderid, scene), lifecycle.FAILED)
+                self.units_done(orderid, len(failed))
+            else:
+                response.status = "retrying"
+            self.placement.forget(task_id)
             if task_id in self.runningList:
                 self.runningList.__delitem__(task_id)
 
         return response
 
 
-def main():
-    cfg       = config.config()    
-    espa_api  = espa.api_connect(cfg)
-    work_list = Queue() # multiprocessing Queue
-    framework = ESPAFramework(cfg, espa_api, work_list)
-
-    # Scheduled requests for espa processing work, and handle-orders call
-    scheduled_process  = Process(target=scheduled_tasks, args=(cfg, espa_api, work_list,))
-
+def run(settings, coordinator=None):
+    cfg          = settings.current
+    standby      = coordinator and cfg.get('ha_mode') != coordination.PARTITION
+    espa_api     = espa.api_connect(cfg)
+    work_list    = queues.LaneQueue(cfg.get('priority_starvation_seconds'))
+    framework_id = coordinator.framework_id() if standby else None
+    framework    = ESPAFramework(cfg, espa_api, work_list, framework_id)
+    espa_runtime = runtime.Runtime(cfg, espa_api, framework, None if standby else coordinator, settings)
+    settings.subscribe(framework.reconfigure)
+
+    if standby:
+        # keep tasks running while a standby takes over, and let it subscribe as the same framework
+        framework.client.set_failover_timeout(cfg.get('mesos_failover_timeout'))
+        framework.client.on(MesosClient.SUBSCRIBED, lambda driver: coordinator.save_framework_id(framework.client.frameworkId))
+    if coordinator:
+        coordinator.on_lost(espa_runtime.stop)
+
+    # Mesos events, scheduled requests for espa processing work, and handle-orders calls share one event loop
     try:
-        scheduled_process.start()
-        framework.client.register()
+        asyncio.run(espa_runtime.run())
     except Exception as err:
-        log.error("espa scheduler encountered an error, killing scheduled processes. tearing down framework. error: {}".format(err))
+        log.error("espa scheduler encountered an error, tearing down framework. error: {}".format(err))
         framework.client.tearDown()
-        scheduled_process.kill()
+
+def main():
+    settings = config.Settings()
+    cfg      = settings.current
+    logger.configure(cfg)
+    if not cfg.get('zookeeper'):
+        return run(settings)
+
+    coordinator = coordination.Coordinator(cfg.get('zookeeper'), cfg.get('zookeeper_path'))
+    coordinator.start()
+    try:
+        if cfg.get('ha_mode') == coordination.PARTITION:
+            coordinator.join()
+            run(settings, coordinator)
+        else:
+            coordinator.run_as_leader(run, settings, coordinator)
+    finally:
+        coordinator.stop()
 
     
 if __name__ == '__main__':
@@ -0,0 +1,35 @@
+from collections import deque
+
+class Summary(object):
+    """
+    Quantiles over the most recent observations, kept in a fixed size ring buffer
+    """
+    def __init__(self, size=1024):
+        self.values = deque(maxlen=size)
+        self.count  = 0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Nearest-rank quantile of the buffered observations
+
+        Args:
+            q: quantile between 0 and 1
+
+        Returns: observed value, or None if nothing has been observed
+        """
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+        return ordered[index]
+
+    def snapshot(self):
+        """Return dict of count, p50, p95 and p99"""
+        return {"count": self.count,
+                "p50":   self.quantile(0.50),
+                "p95":   self.quantile(0.95),
+                "p99":   self.quantile(0.99)}
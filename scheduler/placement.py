@@ -0,0 +1,116 @@
+import time
+
+from scheduler import logger
+from scheduler.metrics import Summary
+
+log = logger.get_logger()
+
+COLD = 0
+WARM_IMAGE = 1
+WARM_PRODUCT = 2
+
+class PlacementScorer(object):
+    """
+    Prefer offers from agents that recently ran our task image and product type,
+    so tasks land on agents with the image pulled and the aux data in page cache
+    """
+    def __init__(self, warm_seconds, cold_hold_seconds):
+        self.warm_seconds = warm_seconds
+        self.cold_hold    = cold_hold_seconds
+        self.history      = {} # agent_id -> {image or (image, product_type): last launch}
+        self.held         = {} # agent_id -> first time we held back from it
+        self.launches     = {} # task_id -> (launch time, warm)
+        self.latency      = {"warm": Summary(), "cold": Summary()}
+
+    def _recent(self, agent_id, key, now):
+        seen = self.history.get(agent_id, {}).get(key)
+        return seen is not None and now - seen <= self.warm_seconds
+
+    def score(self, agent_id, image, product_type, now=None):
+        """
+        Score an agent for running a task
+
+        Args:
+            agent_id: mesos agent id
+            image: docker image for the task
+            product_type: product type of the work unit
+
+        Returns: COLD, WARM_IMAGE or WARM_PRODUCT
+        """
+        now = time.monotonic() if now is None else now
+        if not self._recent(agent_id, image, now):
+            return COLD
+        if self._recent(agent_id, (image, product_type), now):
+            return WARM_PRODUCT
+        return WARM_IMAGE
+
+    def warm_agents(self, image, now=None):
+        now = time.monotonic() if now is None else now
+        return [a for a in self.history if self._recent(a, image, now)]
+
+    def hold(self, agent_id, image, now=None):
+        """
+        Whether to hold back from a cold agent. Only done while warm agents exist,
+        and for no longer than cold_hold seconds per agent
+        """
+        now = time.monotonic() if now is None else now
+        if not self.warm_agents(image, now):
+            return False
+        first = self.held.setdefault(agent_id, now)
+        if now - first > self.warm_seconds:
+            # stale entry from an earlier hold, start over
+            self.held[agent_id] = first = now
+        return now - first < self.cold_hold
+
+    def choose(self, offers, image, product_type, now=None):
+        """
+        Pick the best offer for a work unit
+
+        Args:
+            offers: list of mesoshttp Offers
+            image: docker image for the task
+            product_type: product type of the work unit
+
+        Returns: tuple of (offer, warm), offer is None if all offers are cold and being held back
+        """
+        now = time.monotonic() if now is None else now
+        scored = [(self.score(o.get_offer()['agent_id']['value'], image, product_type, now), o) for o in offers]
+        best_score = max(s for s, _ in scored)
+        if best_score > COLD:
+            return next(o for s, o in scored if s == best_score), True
+
+        for _, offer in scored:
+            if not self.hold(offer.get_offer()['agent_id']['value'], image, now):
+                return offer, False
+        return None, False
+
+    def launched(self, task_id, agent_id, image, product_type, warm):
+        now = time.monotonic()
+        agent = self.history.setdefault(agent_id, {})
+        agent[image] = now
+        agent[(image, product_type)] = now
+        self.held.pop(agent_id, None)
+        self.launches[task_id] = (now, warm)
+
+    def running(self, task_id):
+        """
+        Record launch to running latency for a task
+
+        Returns: tuple of (placement, seconds), or None if the launch wasn't seen
+        """
+        launch = self.launches.pop(task_id, None)
+        if launch is None:
+            return None
+        started, warm = launch
+        placement = "warm" if warm else "cold"
+        seconds = time.monotonic() - started
+        self.latency[placement].observe(seconds)
+        log.debug("{} placement for {} took {:.1f} seconds to start running".format(placement, task_id, seconds))
+        return placement, seconds
+
+    def forget(self, task_id):
+        self.launches.pop(task_id, None)
+
+    def latency_summary(self):
+        """Return launch to running latency quantiles for warm and cold placements"""
+        return {k: v.snapshot() for k, v in self.latency.items()}
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from queue import Empty
+
+from scheduler.dedup import unit_key
+from scheduler.metrics import Summary
+
+LANES = ['high', 'normal', 'low']
+DEFAULT_LANE = 'normal'
+TAKEN_MAX    = 10000
+
+def lane(unit):
+    """Return the priority lane for a work unit"""
+    priority = str(unit.get('priority') or DEFAULT_LANE).lower()
+    return priority if priority in LANES else DEFAULT_LANE
+
+
+class LaneQueue(object):
+    """
+    Work list with a lane per priority. Higher lanes are served first, but a unit
+    that has waited longer than starvation_seconds is served ahead of them.
+
+    Within a lane units are kept per order. Without a FairShare the oldest unit is
+    served first. With one, the next unit comes from the order fair picks, so one
+    large order doesn't hold back every other user's work
+
+    Has the non-blocking parts of the queue.Queue interface used by the scheduler
+    """
+    def __init__(self, starvation_seconds=600, fair=None):
+        self.starvation = starvation_seconds
+        self.fair       = fair
+        self.lanes      = {name: OrderedDict() for name in LANES} # name -> orderid -> deque of (queued at, unit)
+        self.wait       = {name: Summary() for name in LANES}
+        self.taken      = OrderedDict() # (orderid, scene) -> queued at, of recently taken units
+        self.requeued   = set()         # units put back, whose wait was already observed
+        self.lock       = threading.Lock()
+
+    def put_nowait(self, unit, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            orders = self.lanes[lane(unit)]
+            orders.setdefault(unit.get('orderid'), deque()).append((now, unit))
+
+    put = put_nowait
+
+    def get(self, block=False, now=None):
+        """Return the next unit, raises queue.Empty if there are none. Never blocks"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            name, starving = self._next_lane(now)
+            if name is None:
+                raise Empty()
+            orders = self.lanes[name]
+            orderid = self._next_order(orders, starving)
+            queued_at, unit = orders[orderid].popleft()
+            if not orders[orderid]:
+                del orders[orderid]
+
+            key = unit_key(unit)
+            if key in self.requeued:
+                self.requeued.discard(key)
+            else:
+                self.wait[name].observe(now - queued_at)
+            self.taken[key] = queued_at
+            while len(self.taken) > TAKEN_MAX:
+                self.taken.popitem(last=False)
+            return unit
+
+    def requeue(self, unit, now=None):
+        """Put a unit taken but not launched back at the front of its order, keeping its lane and queue time"""
+        now = time.monotonic() if now is None else now
+        key = unit_key(unit)
+        with self.lock:
+            queued_at = self.taken.pop(key, now)
+            self.requeued.add(key)
+            orders = self.lanes[lane(unit)]
+            orders.setdefault(unit.get('orderid'), deque()).appendleft((queued_at, unit))
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def _oldest(self, orders):
+        return min(units[0][0] for units in orders.values()) if orders else None
+
+    def _next_lane(self, now):
+        # the starving lane whose unit has waited longest goes first, the higher lane on a tie,
+        # then the highest lane with any units
+        starving = None
+        for name in LANES:
+            oldest = self._oldest(self.lanes[name])
+            if oldest is not None and now - oldest > self.starvation:
+                if starving is None or oldest < starving[1]:
+                    starving = (name, oldest)
+        if starving:
+            return starving[0], True
+        for name in LANES:
+            if self.lanes[name]:
+                return name, False
+        return None, False
+
+    def _next_order(self, orders, starving):
+        oldest = lambda orderid: orders[orderid][0][0]
+        if starving or self.fair is None:
+            return min(orders, key=oldest)
+        return min(orders, key=lambda orderid: (self.fair.rank(orderid), oldest(orderid)))
+
+    def qsize(self):
+        with self.lock:
+            return sum(len(units) for orders in self.lanes.values() for units in orders.values())
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def stats(self):
+        """Return units queued, orders queued and queue wait time quantiles, per lane"""
+        with self.lock:
+            return {name: {"queued": sum(len(units) for units in orders.values()), "orders": len(orders),
+                           "wait": self.wait[name].snapshot()}
+                    for name, orders in self.lanes.items()}
@@ -0,0 +1,388 @@
+"""
+Single process asyncio runtime. The Mesos event stream, periodic requests for
+products to process and handle-orders calls all run off one event loop, and
+share one in-memory work list with the ESPAFramework
+"""
+import asyncio
+import functools
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full
+
+from scheduler import dedup, lifecycle, logger, util
+
+log = logger.get_logger()
+
+class Runtime(object):
+
+    def __init__(self, cfg, espa_api, framework, coordinator=None, settings=None):
+        self.cfg       = cfg
+        self.espa      = espa_api
+        self.framework = framework
+        # partitions product types between instances, when running more than one
+        self.coordinator = coordinator
+        # reloads tunables on SIGHUP, or when the config file changes
+        self.settings  = settings
+        self.products  = framework.products
+        # requests is blocking, so API calls run on a bounded pool of threads
+        self.executor  = ThreadPoolExecutor(max_workers=cfg.get('espa_api_concurrency'),
+                                            thread_name_prefix='espa-api')
+        self.stopping  = None
+        self.loop      = None
+        self.created_at  = time.monotonic()
+        self.first_fetch = None # seconds from start until the first fetch finished
+        # handle-orders is called when orders finish, the periodic call is a fallback
+        self.finished       = 0    # units finished or failed since the last handle-orders call
+        self.handled_at     = None
+        self.handle_pending = None
+        self.retrigger      = False
+        # bounds /handle-orders load to the old fixed poll on average, however busy it gets
+        self.handle_budget  = util.TokenBucket(cfg.get('handle_orders_rate_seconds'), cfg.get('handle_orders_bucket'))
+        framework.on_units_done = self.units_done
+        self.stream_ended   = False
+        self.drain_progress = None
+
+    async def call(self, fn, *args, **kwargs):
+        """Run a blocking ESPA API call without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def fetch(self):
+        """Request products to process for the next product type, and mark them scheduled"""
+        try:
+            return await self._fetch()
+        finally:
+            if self.first_fetch is None:
+                self.first_fetch = time.monotonic() - self.created_at
+                log.info("Initial fetch finished {:.2f} seconds after start".format(self.first_fetch))
+
+    async def _fetch(self):
+        work_list = self.framework.workList
+
+        if not self.espa.available():
+            log.info("ESPA API unavailable, not requesting products to process")
+            return 0
+
+        enabled = await self.call(self.espa.mesos_tasks_enabled)
+        if enabled is None:
+            log.info("run_mesos_tasks unknown, not requesting products to process")
+            return 0
+        if not enabled:
+            log.debug("mesos tasks disabled, not requesting products to process")
+            # only an explicit 'run_mesos_tasks' off hands work back, not a failed lookup
+            if work_list.qsize() or self.framework.retryList:
+                await self.drain("mesos tasks disabled")
+            return 0
+
+        if work_list.qsize() >= self.cfg.get('product_scheduled_max'):
+            log.info("Max number of tasks scheduled, not requesting more products to process")
+            return 0
+
+        assigned = None
+        if self.coordinator:
+            assigned = await self.call(self.coordinator.assigned, list(self.products))
+        product_type = self.next_product_type(assigned)
+        if product_type is None:
+            log.info("No product types assigned to this instance, not requesting products to process")
+            return 0
+
+        units = await self.request_products(product_type)
+        self.framework.governor.observe_fetch(product_type, len(units), self.cfg.get('product_request_count'))
+        if not units:
+            log.info("No work to do for product_type: {}".format(product_type))
+            return 0
+
+        log.info("Work to do for product_type: {}, count: {}, appending to work list".format(product_type, len(units)))
+        fetched = []
+        index = self.framework.index
+        for u in units:
+            if index.add(u):
+                fetched.append(u)
+                self.framework.lifecycle.mark(dedup.unit_key(u), lifecycle.FETCHED, u.get('product_type'))
+
+        # update retrieved products in espa to scheduled status, concurrently, and only queue them once
+        # that's done, so a unit launched right away can't have 'scheduled' land after 'tasked'
+        results = await asyncio.gather(*[self.call(self.espa.set_to_scheduled, u) for u in fetched],
+                                       return_exceptions=True)
+        queued = []
+        for u, result in zip(fetched, results):
+            key = dedup.unit_key(u)
+            if isinstance(result, Exception):
+                log.error("problem scheduling a task, not queueing it! unit: {} \n error: {}".format(u, result))
+                index.remove(key)
+                self.framework.lifecycle.forget(key)
+                continue
+            self.framework.lifecycle.mark(key, lifecycle.SCHEDULED)
+            try:
+                work_list.put_nowait(u)
+                queued.append(u)
+            except Full:
+                log.error("work_list queue is full!")
+                index.remove(key)
+                self.framework.lifecycle.forget(key)
+        if hasattr(work_list, 'stats'):
+            log.debug("Work list by priority: {}, running by user: {}".format(work_list.stats(),
+                      self.framework.fair.shares()))
+        if len(fetched) < len(units):
+            log.warning("Dropped {} duplicate units for product_type: {}, index: {}".format(
+                        len(units) - len(fetched), product_type, index.metrics()))
+        return len(queued)
+
+    async def request_products(self, product_type):
+        """
+        Request units of a product type. With product_priorities configured, each priority is
+        requested in turn until request_count units are found, so urgent units come first
+        """
+        limit = self.cfg.get('product_request_count')
+        priorities = self.cfg.get('product_priorities')
+        if not priorities:
+            resp = await self.call(self.espa.get_products_to_process, [product_type], limit)
+            return resp.get("products") or []
+
+        units = []
+        for priority in priorities:
+            if len(units) >= limit:
+                break
+            resp = await self.call(self.espa.get_products_to_process, [product_type], limit - len(units),
+                                   priority=priority)
+            units.extend(resp.get("products") or [])
+        return units
+
+    def next_product_type(self, assigned=None):
+        """Rotate the product types list to the next type, skipping types not in assigned"""
+        for _ in range(len(self.products)):
+            product_type = util.rotate(self.products)
+            if assigned is None or product_type in assigned:
+                return product_type
+        return None
+
+    async def drain(self, reason, timeout=0):
+        """
+        Hand queued units back to ESPA as 'submitted', in batches of concurrent calls, then wait
+        up to timeout seconds for launched tasks to finish
+
+        Returns: dict of drain progress
+        """
+        units = self.framework.take_queued()
+        progress = self.drain_progress = {"reason": reason, "queued": len(units), "returned": 0,
+                                          "failed": 0, "deferred": 0, "tasks": len(self.framework.taskedList)}
+        log.warning("Draining, {}: returning {} queued units to ESPA".format(reason, len(units)))
+
+        size = self.cfg.get('drain_batch_size')
+        for start in range(0, len(units), size):
+            batch = units[start:start + size]
+            results = await asyncio.gather(*[self.call(self.espa.update_status, u.get('scene'), u.get('orderid'),
+                                                       'submitted') for u in batch], return_exceptions=True)
+            for u, result in zip(batch, results):
+                key = dedup.unit_key(u)
+                if isinstance(result, Exception):
+                    # still scheduled in ESPA, keep it to run here or be returned by the next drain
+                    log.error("Error returning unit {} to submitted, exception: {}".format(key, result))
+                    progress["failed"] += 1
+                    self.framework.workList.put_nowait(u)
+                    continue
+                if isinstance(result, dict) and result.get("status") == "deferred":
+                    progress["deferred"] += 1
+                else:
+                    progress["returned"] += 1
+                self.framework.index.remove(key)
+                self.framework.lifecycle.forget(key)
+            log.warning("Draining, {}: {}".format(reason, progress))
+
+        deadline = time.monotonic() + timeout
+        reported = 0
+        while self.framework.taskedList and time.monotonic() < deadline:
+            if time.monotonic() - reported >= 10:
+                log.warning("Draining, waiting up to {:.0f} seconds for {} launched tasks to finish".format(
+                            deadline - time.monotonic(), len(self.framework.taskedList)))
+                reported = time.monotonic()
+            await asyncio.sleep(1)
+        progress["tasks"] = len(self.framework.taskedList)
+        log.warning("Drained, {}: {}".format(reason, progress))
+        return progress
+
+    async def handle_orders(self):
+        if not self.espa.available():
+            log.info("ESPA API unavailable, not calling handle-orders")
+            return False
+        if not self.handle_budget.take():
+            log.info("handle-orders call budget used up, not calling handle-orders")
+            return False
+        self.finished   = 0
+        self.handled_at = time.monotonic()
+        return await self.call(self.espa.handle_orders)
+
+    async def fallback_handle_orders(self):
+        """Call handle-orders, unless a triggered call was made within handle_orders_frequency"""
+        if self.handled_at is not None and time.monotonic() - self.handled_at < self.cfg.get('handle_orders_frequency') * 60:
+            return False
+        return await self.handle_orders()
+
+    def units_done(self, orderid, count, order_done):
+        """Note units finished or failed, safe to call from the Mesos event thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.order_activity, orderid, count, order_done)
+
+    def order_activity(self, orderid, count, order_done):
+        self.finished += count
+        if order_done:
+            log.info("No units of order {} left, triggering handle-orders".format(orderid))
+            self.trigger_handle_orders()
+        elif self.finished >= self.cfg.get('handle_orders_burst'):
+            log.info("{} units done since the last handle-orders, triggering handle-orders".format(self.finished))
+            self.trigger_handle_orders()
+
+    def trigger_handle_orders(self):
+        """Call handle-orders soon, triggers made before the call is made share it"""
+        if self.handle_pending is not None and not self.handle_pending.done():
+            self.retrigger = True
+            return
+        self.handle_pending = asyncio.ensure_future(self.debounced_handle_orders())
+
+    async def debounced_handle_orders(self):
+        # wait for more triggers to coalesce, keep calls handle_orders_min_seconds apart, and within the budget
+        while True:
+            wait = max(self.cfg.get('handle_orders_debounce'), self.handle_budget.wait())
+            if self.handled_at is not None:
+                wait = max(wait, self.handled_at + self.cfg.get('handle_orders_min_seconds') - time.monotonic())
+            await asyncio.sleep(wait)
+            self.retrigger = False
+            try:
+                await self.handle_orders()
+            except Exception as e:
+                log.error("Error in triggered call to handle_orders, exception: {}".format(e))
+            # call again for triggers made while the call was in flight
+            if not self.retrigger:
+                return
+
+    async def flush(self):
+        """Replay status writes deferred while the ESPA API was unavailable"""
+        return await self.call(self.espa.flush_deferred)
+
+    def reconfigure(self, cfg):
+        """Pick up new tunable values, used from the next cycle of each periodic call"""
+        self.cfg = cfg
+        breaker = self.espa.breaker
+        breaker.failure_threshold = cfg.get('api_failure_threshold')
+        breaker.reset_seconds     = cfg.get('api_reset_seconds')
+        breaker.slow_seconds      = cfg.get('api_slow_seconds')
+        self.espa.timeout         = cfg.get('api_timeout_seconds')
+        self.handle_budget.rate_seconds = cfg.get('handle_orders_rate_seconds')
+        self.handle_budget.capacity     = cfg.get('handle_orders_bucket')
+
+    async def report(self):
+        """
+        Log unit lifecycle latency, launch to running latency by placement, quarantined agents and
+        ESPA API call stats, and export the trace of completed units if configured
+        """
+        tracker = self.framework.lifecycle
+        log.info("Unit lifecycle seconds, {} units in flight: {}".format(tracker.in_flight(), tracker.summary()))
+        log.info("Launch to running seconds by placement: {}".format(self.framework.placement.latency_summary()))
+        log.info("Quarantined agents: {}".format(self.framework.agent_exclusions()))
+        log.info("ESPA API calls, {} deferred writes: {}".format(len(self.espa.deferred), self.espa.breaker.metrics()))
+        path = self.cfg.get('lifecycle_trace_file')
+        if path:
+            count = await self.call(tracker.export, path)
+            log.debug("Exported {} completed units to {}".format(count, path))
+
+    async def reload(self):
+        return await self.call(self.settings.reload)
+
+    async def watch(self):
+        if self.settings.changed_on_disk():
+            log.info("Config file {} changed, reloading".format(self.settings.path))
+            await self.reload()
+
+    async def periodic(self, seconds, coro_fn):
+        """Await coro_fn every seconds(), read again each cycle, until cancelled"""
+        while True:
+            try:
+                await coro_fn()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Error in scheduled call to {}, exception: {}".format(coro_fn.__name__, e))
+            await asyncio.sleep(seconds())
+
+    def subscribe(self, loop):
+        """
+        Run the blocking Mesos event stream on a daemon thread
+
+        Returns: future resolved when the stream ends
+        """
+        done = loop.create_future()
+
+        def target():
+            try:
+                result = self.framework.client.register()
+            except Exception as e:
+                result = e
+            try:
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(result))
+            except RuntimeError:
+                pass # the loop closed after shutdown
+
+        threading.Thread(target=target, name='mesos-events', daemon=True).start()
+        return done
+
+    def stop(self):
+        """Stop the runtime, safe to call from any thread"""
+        log.warning("Stopping espa scheduler")
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def run(self):
+        self.loop = loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass # not on the main thread
+
+        log.debug("calling get_products_to_process with frequency: {} minutes".format(self.cfg.get('product_request_frequency')))
+        log.debug("calling handle_orders as orders finish, and with fallback frequency: {} minutes".format(
+                  self.cfg.get('handle_orders_frequency')))
+
+        tasks = [asyncio.ensure_future(self.periodic(lambda: self.cfg.get('product_request_frequency') * 60, self.fetch)),
+                 asyncio.ensure_future(self.periodic(lambda: self.cfg.get('handle_orders_frequency') * 60, self.fallback_handle_orders)),
+                 asyncio.ensure_future(self.periodic(lambda: self.cfg.get('api_reset_seconds'), self.flush)),
+                 asyncio.ensure_future(self.periodic(lambda: self.cfg.get('lifecycle_report_seconds'), self.report))]
+        if self.settings:
+            self.settings.subscribe(self.reconfigure)
+            try:
+                loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reload()))
+            except (NotImplementedError, RuntimeError):
+                pass # not on the main thread
+            if self.settings.path:
+                tasks.append(asyncio.ensure_future(self.periodic(lambda: self.cfg.get('config_watch_seconds'), self.watch)))
+        events  = self.subscribe(loop)
+        stopped = asyncio.ensure_future(self.stopping.wait())
+
+        try:
+            done, _ = await asyncio.wait([events, stopped], return_when=asyncio.FIRST_COMPLETED)
+            if events in done:
+                self.stream_ended = True
+                log.error("Mesos event stream ended, result: {}".format(events.result()))
+        finally:
+            await self.shutdown(tasks + [stopped])
+
+    async def shutdown(self, tasks):
+        if self.handle_pending is not None:
+            tasks = tasks + [self.handle_pending]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # stop launching, and hand queued work back so other processing locations can take it
+        self.framework.start_draining()
+        try:
+            # without the event stream there are no status updates to wait for
+            await self.drain("shutting down", 0 if self.stream_ended else self.cfg.get('drain_timeout_seconds'))
+        except Exception as e:
+            log.error("Error draining, exception: {}".format(e))
+        self.framework.client.tearDown()
+        self.executor.shutdown(wait=False)
+        log.warning("espa scheduler stopped")
@@ -1,6 +1,10 @@
 from addict import Dict
 import json
 
+ORDER_SEP = "_@@@_"
+SCENE_SEP = "_+++_"
+ATTEMPT_SEP = "_###_"
+
 def env_vars(cfg):
     """Return list of dicts defining task environment vars"""
     return [{"name":"ESPA_STORAGE",          "value":cfg.get('espa_storage')},
@@ -28,10 +32,26 @@ def resources(cpus, memory, disk):
             {'name':'disk', 'type':'SCALAR', 'scalar':{'value': disk}}]
 
 def command(work_json):
-    """Return formatted command for the task container"""
-    cmd = "python /src/processing/main.py '{}'".format(json.dumps([work_json]).replace(' ', ''))
+    """Return formatted command for the task container, work_json may be a unit or list of units"""
+    units = work_json if isinstance(work_json, list) else [work_json]
+    cmd = "python /src/processing/main.py '{}'".format(json.dumps(units).replace(' ', ''))
     return cmd
 
+def task_id(orderid, scenes, attempt=0):
+    """Return task id for one or more scenes from the same order, suffixed with the retry attempt if any"""
+    id = "{}{}{}".format(orderid, ORDER_SEP, SCENE_SEP.join(scenes))
+    return "{}{}{}".format(id, ATTEMPT_SEP, attempt) if attempt else id
+
+def decode_id(id):
+    """Return tuple of orderid and list of scenes for a task id"""
+    orderid, scenes = id.split(ORDER_SEP)
+    return orderid, scenes.split(ATTEMPT_SEP)[0].split(SCENE_SEP)
+
+def decode_attempt(id):
+    """Return the retry attempt a task id was launched for, 0 for the first"""
+    _, sep, attempt = id.rpartition(ATTEMPT_SEP)
+    return int(attempt) if sep else 0
+
 def build(id, offer, image_name, cpu, mem, disk, work, cfg):
     task                        = Dict()
     task.task_id.value          = id
@@ -1,5 +1,45 @@
+import time
 from datetime import datetime
 
 def right_now():
     """Return a formatted string version of datetime.now()"""
     return datetime.now().strftime('%m-%d-%Y:%H:%M:%S.%f')
+
+def rotate(items):
+    """Move the first item of a list to the back, and return it"""
+    item = items.pop(0)
+    items.append(item)
+    return item
+
+class TokenBucket(object):
+    """
+    Rate budget averaging one token per rate_seconds, allowing bursts of up to capacity.
+    rate_seconds and capacity are read on each call, so they can be changed while running
+    """
+    def __init__(self, rate_seconds, capacity=1):
+        self.rate_seconds = rate_seconds
+        self.capacity     = capacity
+        self.tokens       = capacity
+        self.updated      = None
+
+    def _refill(self, now):
+        if self.updated is not None and self.rate_seconds > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.rate_seconds)
+        elif self.rate_seconds <= 0:
+            self.tokens = self.capacity
+        self.updated = now
+
+    def wait(self, now=None):
+        """Return seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return max(0, (1 - self.tokens) * self.rate_seconds)
+
+    def take(self, now=None):
+        """Take a token if one is available, returns whether one was taken"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
@@ -1,3 +1,5 @@
+import json
+import tempfile
 import unittest
 import os
 import re
@@ -22,9 +24,67 @@ class TestConfig(unittest.TestCase):
     def test_config(self):
         cfg = config.config()
         self.assertEqual(sorted(list(cfg.keys())),
-                         sorted(['mesos_principal', 'mesos_secret', 'mesos_master', 'mesos_user', 'product_frequency',
-                          'espa_api', 'product_request_count', 'product_request_frequency', 'product_scheduled_max', 
-                          'max_cpu', 'task_cpu', 'task_mem', 'task_disk', 'task_image', 'offer_refuse_seconds', 
+                         sorted(['mesos_principal', 'mesos_secret', 'mesos_master', 'mesos_user', 'mesos_failover_timeout', 'zookeeper', 'zookeeper_path', 'ha_mode',
+                          'product_frequency',
+                          'espa_api', 'espa_api_concurrency', 'api_failure_threshold', 'api_reset_seconds',
+                          'api_slow_seconds', 'api_timeout_seconds', 'product_request_count', 'product_request_frequency', 'product_scheduled_max', 'product_priorities', 'priority_starvation_seconds', 'fair_share_weights', 'drain_batch_size', 'drain_timeout_seconds', 'dedup_grace_seconds', 'dedup_max_entries', 'lifecycle_trace_size', 'lifecycle_report_seconds', 'lifecycle_trace_file',
+                          
+                          'max_cpu', 'max_cpu_floor', 'max_cpu_ceiling', 'max_cpu_step', 'max_cpu_hold_seconds',
+                          'max_cpu_peak_hours', 'max_cpu_peak_ceiling', 'task_cpu', 'task_mem', 'task_disk', 'task_image', 'task_batch_size', 'task_batch_types', 'offer_refuse_seconds', 'task_retry_max', 'task_retry_backoff',
+                          'placement_warm_seconds', 'placement_cold_hold', 'agent_failure_window',
+                          'agent_failure_max', 'agent_failure_rate', 'agent_quarantine_seconds',
                           'auxiliary_mount', 'aux_dir', 'storage_mount', 'espa_storage', 'aster_ged_server_name', 
-                          'handle_orders_frequency', 'log_level', 'urs_machine', 'urs_login', 'urs_password']))
+                          'handle_orders_frequency', 'handle_orders_debounce', 'handle_orders_min_seconds', 'handle_orders_rate_seconds', 'handle_orders_bucket', 'handle_orders_burst', 'log_level', 'urs_machine', 'urs_login', 'urs_password',
+                          'config_file', 'config_watch_seconds']))
 
+
+    def write_config(self, values):
+        f = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        json.dump(values, f)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_validate(self):
+        cfg = config.config()
+        cfg['max_cpu'] = '12'
+        self.assertEqual(config.validate(cfg)['max_cpu'], 12)
+
+        cfg['max_cpu'] = 'lots'
+        with self.assertRaises(ValueError):
+            config.validate(cfg)
+
+        cfg['max_cpu'] = -1
+        with self.assertRaises(ValueError):
+            config.validate(cfg)
+
+    def test_load(self):
+        path = self.write_config({"max_cpu": 20, "modis_frequency": 0})
+        cfg = config.load(path)
+        self.assertEqual(cfg['max_cpu'], 20)
+        self.assertNotIn('modis', cfg['product_frequency'])
+
+        with self.assertRaises(ValueError):
+            config.load(self.write_config({"mesos_secret": "sneaky"}))
+
+    def test_diff(self):
+        self.assertEqual(config.diff({"a": 1, "b": 2}, {"a": 1, "b": 3}), {"b": (2, 3)})
+
+    def test_settings_reload(self):
+        path = self.write_config({"max_cpu": 20})
+        settings = config.Settings(path)
+        seen = []
+        settings.subscribe(seen.append)
+
+        with open(path, 'w') as f:
+            json.dump({"max_cpu": 30}, f)
+        changes = settings.reload()
+        self.assertEqual(changes, {"max_cpu": (20, 30)})
+        self.assertEqual(settings.current['max_cpu'], 30)
+        self.assertEqual(seen, [settings.current])
+
+        # invalid values keep the current config
+        with open(path, 'w') as f:
+            json.dump({"max_cpu": "many"}, f)
+        self.assertEqual(settings.reload(), {})
+        self.assertEqual(settings.current['max_cpu'], 30)
@@ -0,0 +1,75 @@
+import os
+import unittest
+import uuid
+
+from kazoo.exceptions import NoNodeError
+from unittest.mock import Mock
+
+from scheduler import coordination
+from scheduler.coordination import Coordinator
+
+class TestCoordination(unittest.TestCase):
+    def setUp(self):
+        self.products = ['landsat', 'landsat', 'landsat', 'modis', 'modis', 'viirs', 'plot']
+        self.client = Mock()
+        self.coordinator = Coordinator(None, '/espa-scheduler/', 'instance-1', client=self.client)
+
+    def test_partition(self):
+        members = ['member-0000000002', 'member-0000000001']
+        first  = coordination.partition(self.products, members, 'member-0000000001')
+        second = coordination.partition(self.products, members, 'member-0000000002')
+        self.assertEqual(first, ['landsat', 'landsat', 'landsat', 'plot'])
+        self.assertEqual(second, ['modis', 'modis', 'viirs'])
+        self.assertEqual(coordination.partition(self.products, ['member-0000000001'], 'member-0000000001'), self.products)
+        self.assertEqual(coordination.partition(self.products, members, 'member-0000000003'), [])
+
+    def test_framework_id(self):
+        self.client.get.return_value = (b'abc-123', None)
+        self.assertEqual(self.coordinator.framework_id(), 'abc-123')
+        self.client.get.assert_called_with('/espa-scheduler/framework_id')
+
+        self.client.get.side_effect = NoNodeError()
+        self.assertIsNone(self.coordinator.framework_id())
+
+    def test_save_framework_id(self):
+        self.client.exists.return_value = None
+        self.coordinator.save_framework_id('abc-123')
+        self.client.create.assert_called_once_with('/espa-scheduler/framework_id', b'abc-123', makepath=True)
+
+    def test_assigned(self):
+        self.client.create.return_value = '/espa-scheduler/members/member-0000000001'
+        self.client.get_children.return_value = ['member-0000000001', 'member-0000000002']
+        self.assertEqual(self.coordinator.join(), 'member-0000000001')
+        self.assertEqual(self.coordinator.assigned(self.products), ['landsat', 'landsat', 'landsat', 'plot'])
+
+
+@unittest.skipUnless(os.environ.get('ZOOKEEPER_HOSTS'), "ZOOKEEPER_HOSTS not set")
+class TestCoordinationZooKeeper(unittest.TestCase):
+    def setUp(self):
+        self.path = '/espa-scheduler-test-{}'.format(uuid.uuid4().hex)
+        self.first  = Coordinator(os.environ['ZOOKEEPER_HOSTS'], self.path, 'first')
+        self.second = Coordinator(os.environ['ZOOKEEPER_HOSTS'], self.path, 'second')
+        self.first.start()
+        self.second.start()
+
+    def tearDown(self):
+        self.first.client.delete(self.path, recursive=True)
+        self.first.stop()
+        self.second.stop()
+
+    def test_framework_id(self):
+        self.assertIsNone(self.second.framework_id())
+        self.first.save_framework_id('abc-123')
+        self.assertEqual(self.second.framework_id(), 'abc-123')
+
+    def test_leader(self):
+        self.assertEqual(self.first.run_as_leader(lambda: 'led'), 'led')
+
+    def test_partition_failover(self):
+        products = ['landsat', 'modis']
+        self.first.join()
+        self.second.join()
+        self.assertEqual(len(self.first.assigned(products)) + len(self.second.assigned(products)), 2)
+
+        self.second.stop()
+        self.assertEqual(self.first.assigned(products), products)
@@ -0,0 +1,46 @@
+import unittest
+
+from scheduler import dedup
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.index = dedup.UnitIndex(60, 3)
+        self.unit = {"orderid": "o1", "scene": "s1"}
+
+    def test_add_duplicate(self):
+        self.assertTrue(self.index.add(self.unit, now=0))
+        self.assertFalse(self.index.add(dict(self.unit), now=1))
+        self.index.update(("o1", "s1"), dedup.RUNNING, now=2)
+        self.assertFalse(self.index.add(self.unit, now=3))
+        self.assertEqual(self.index.metrics(), {"units": {"running": 1}, "dropped": {"queued": 1, "running": 1}})
+
+    def test_finished_grace(self):
+        self.index.add(self.unit, now=0)
+        self.index.update(("o1", "s1"), dedup.FINISHED, now=10)
+        self.assertFalse(self.index.add(self.unit, now=60))
+        self.assertTrue(self.index.add(self.unit, now=80))
+        self.assertEqual(self.index.state(("o1", "s1")), dedup.QUEUED)
+
+    def test_bounded(self):
+        self.index.add({"orderid": "o1", "scene": "s1"}, now=0)
+        self.index.add({"orderid": "o1", "scene": "s2"}, now=0)
+        self.index.update(("o1", "s1"), dedup.FINISHED, now=1)
+        self.index.add({"orderid": "o1", "scene": "s3"}, now=2)
+        self.index.add({"orderid": "o1", "scene": "s4"}, now=3)
+        self.index.add({"orderid": "o1", "scene": "s5"}, now=4)
+        self.assertLessEqual(len(self.index.units), 4)
+        self.assertIsNone(self.index.state(("o1", "s1")))
+        self.assertEqual(self.index.state(("o1", "s5")), dedup.QUEUED)
+
+    def test_open_units(self):
+        self.index.add({"orderid": "o1", "scene": "s1"}, now=0)
+        self.index.add({"orderid": "o1", "scene": "s2"}, now=0)
+        self.index.update(("o1", "s1"), dedup.RUNNING, now=1)
+        self.assertEqual(self.index.open_units("o1"), 2)
+        self.index.update(("o1", "s1"), dedup.FINISHED, now=2)
+        self.assertEqual(self.index.open_units("o1"), 1)
+        self.index.update(("o1", "s2"), dedup.FINISHED, now=3)
+        self.assertEqual(self.index.open_units("o1"), 0)
+        # units launched before a restart aren't counted
+        self.index.update(("o2", "s1"), dedup.FINISHED, now=4)
+        self.assertEqual(self.index.open, {})
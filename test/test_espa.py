@@ -8,7 +8,7 @@ import unittest
 from unittest.mock import Mock
 from mock import patch
 
-from scheduler.espa import api_connect, APIServer, APIException
+from scheduler.espa import api_connect, APIServer, APIException, CircuitBreaker, CircuitOpen
 
 class TestEspa(unittest.TestCase):
 
@@ -39,7 +39,7 @@ class TestEspa(unittest.TestCase):
             m.get("{}/foo".format(self.host), json={"frodo": "baggins"})
             self.api.request('get', resource="foo", status=900)
        
-    def raiseRequestException(*args): # this could be done better
+    def raiseRequestException(*args, **kwargs): # this could be done better
         raise requests.RequestException()
      
     @patch('requests.request', raiseRequestException)
@@ -47,6 +47,18 @@ class TestEspa(unittest.TestCase):
         with self.assertRaises(APIException):
             self.api.request('get')
 
+    @patch('requests.request')
+    def test_request_timeout(self, request):
+        # a hung API times out, and counts as a failure against the circuit
+        request.side_effect = requests.Timeout()
+        api = APIServer(self.host, self.image, CircuitBreaker(failure_threshold=2), timeout=5)
+        for _ in range(2):
+            with self.assertRaises(APIException):
+                api.request('get', 'products')
+        self.assertEqual(request.call_args[1]['timeout'], 5)
+        self.assertEqual(api.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(api.breaker.metrics()['endpoints']['products']['failures'], 2)
+
     @requests_mock.mock()
     def test_get_configuration(self, m):
         m.get("{}/configuration/{}".format(self.host, "mesos_master"), json={"mesos_master": "127.0.0.1:999"})
@@ -86,6 +98,14 @@ class TestEspa(unittest.TestCase):
         m.get("{}/configuration/run_mesos_tasks".format(self.host), json={"run_mesos_tasks": 'True'})
         resp = self.api.mesos_tasks_disabled()
         self.assertEqual(resp, False)
+        self.assertTrue(self.api.mesos_tasks_enabled())
+
+        m.get("{}/configuration/run_mesos_tasks".format(self.host), json={"run_mesos_tasks": 'False'})
+        self.assertFalse(self.api.mesos_tasks_enabled())
+
+        m.get("{}/configuration/run_mesos_tasks".format(self.host), status_code=502, json={})
+        self.assertIsNone(self.api.mesos_tasks_enabled())
+        self.assertTrue(self.api.mesos_tasks_disabled())
 
     def test__unexpected_status(self):
         with self.assertRaises(Exception):
@@ -97,6 +117,78 @@ class TestEspa(unittest.TestCase):
         resp = self.api.test_connection()
         self.assertTrue(resp)
 
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, slow_seconds=10)
+        breaker.record("/products", 1, False, now=0)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record("/products", 11, True, now=1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow(now=20))
+        self.assertFalse(breaker.available(now=20))
+
+        # one probe at a time once reset_seconds has passed
+        self.assertTrue(breaker.available(now=31))
+        self.assertTrue(breaker.allow(now=31))
+        self.assertFalse(breaker.allow(now=31))
+        breaker.record("/products", 1, False, now=32)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        # a call started before the circuit opened doesn't close it
+        breaker.record("/products", 9, True, now=40)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        self.assertTrue(breaker.allow(now=62))
+        # nor does one started before the probe
+        breaker.record("/products", 5, True, now=63)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record("/products", 1, True, now=63, started=62)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.metrics()["endpoints"]["/products"]["failures"], 3)
+
+    @requests_mock.mock()
+    def test_request_circuit_open(self, m):
+        self.api.breaker = CircuitBreaker(failure_threshold=1)
+        m.get("{}/foo".format(self.host), status_code=503, json={})
+        self.api.request('get', resource="foo")
+        self.assertFalse(self.api.available())
+        with self.assertRaises(CircuitOpen):
+            self.api.request('get', resource="foo")
+        self.assertEqual(m.call_count, 1)
+
+    @requests_mock.mock()
+    def test_deferred_writes(self, m):
+        m.post("{}/update_status".format(self.host), json={"foo": 1})
+        self.api.breaker.state = CircuitBreaker.OPEN
+        self.api.breaker.opened_at = 0
+        self.api.breaker.reset_seconds = 10 ** 9
+        resp = self.api.update_status("L71234EDC", "espa-frodo@shire.com-1234", "tasked")
+        self.assertEqual(resp["status"], "deferred")
+        self.assertEqual(self.api.flush_deferred(), 0)
+        self.assertEqual(m.call_count, 0)
+
+        self.api.breaker.state = CircuitBreaker.CLOSED
+        self.assertEqual(self.api.flush_deferred(), 1)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(len(self.api.deferred), 0)
+
+    @requests_mock.mock()
+    def test_deferred_latest(self, m):
+        m.post("{}/update_status".format(self.host), json={"foo": 1})
+        self.api.breaker.state = CircuitBreaker.OPEN
+        self.api.breaker.opened_at = 0
+        self.api.breaker.reset_seconds = 10 ** 9
+        self.api.update_status("s1", "o1", "scheduled")
+        self.api.update_status("s2", "o1", "scheduled")
+        self.api.update_status("s1", "o1", "tasked")
+        self.assertEqual(list(self.api.deferred), [("o1", "s2"), ("o1", "s1")])
+
+        # a write made once the API is back replaces the deferred one
+        self.api.breaker.state = CircuitBreaker.CLOSED
+        self.api.update_status("s2", "o1", "tasked")
+        self.assertEqual(self.api.flush_deferred(), 1)
+        statuses = [(r.json()["name"], r.json()["status"]) for r in m.request_history]
+        self.assertEqual(statuses, [("s2", "tasked"), ("s1", "tasked")])
+
     @requests_mock.mock()
     def test_api_connect(self, m):
         m.get(self.host, json={"foo": 1})
@@ -0,0 +1,33 @@
+import unittest
+
+from scheduler import failure
+
+class TestFailure(unittest.TestCase):
+
+    def test_classify(self):
+        lost = {'status': {'state': 'TASK_LOST'}}
+        self.assertEqual(failure.classify(lost), failure.INFRASTRUCTURE)
+
+        launch = {'status': {'state': 'TASK_FAILED', 'reason': 'REASON_CONTAINER_LAUNCH_FAILED'}}
+        self.assertEqual(failure.classify(launch), failure.INFRASTRUCTURE)
+
+        failed = {'status': {'state': 'TASK_FAILED', 'reason': 'REASON_COMMAND_EXECUTOR_FAILED'}}
+        self.assertEqual(failure.classify(failed), failure.PROCESSING)
+
+    def test_agent_fault(self):
+        self.assertTrue(failure.agent_fault({'status': {'state': 'TASK_FAILED'}}))
+        self.assertTrue(failure.agent_fault({'status': {'state': 'TASK_FAILED',
+                                                        'reason': 'REASON_CONTAINER_LAUNCH_FAILED'}}))
+        self.assertFalse(failure.agent_fault({'status': {'state': 'TASK_LOST'}}))
+        self.assertFalse(failure.agent_fault({'status': {'state': 'TASK_FAILED',
+                                                         'reason': 'REASON_MASTER_DISCONNECTED'}}))
+
+    def test_retry_budget(self):
+        budget = failure.RetryBudget(2, 10, max_backoff_seconds=15)
+        self.assertTrue(budget.allow("foo"))
+        self.assertEqual(budget.record("foo"), 10)
+        self.assertEqual(budget.record("foo"), 15)
+        self.assertFalse(budget.allow("foo"))
+
+        budget.clear("foo")
+        self.assertTrue(budget.allow("foo"))
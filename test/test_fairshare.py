@@ -0,0 +1,38 @@
+import unittest
+
+from scheduler import fairshare
+
+class TestFairShare(unittest.TestCase):
+    def setUp(self):
+        self.fair = fairshare.FairShare({"big@usgs.gov": 2})
+
+    def test_user(self):
+        self.assertEqual(fairshare.user("espa-foo@umb.edu-05232017-123456-789"), "foo@umb.edu")
+        self.assertEqual(fairshare.user("bar@usgs.gov-0101201812345"), "bar@usgs.gov")
+        self.assertEqual(fairshare.user("orderid"), "orderid")
+        self.assertEqual(fairshare.user(None), None)
+
+    def test_parse_weights(self):
+        self.assertEqual(fairshare.parse_weights(None), {})
+        self.assertEqual(fairshare.parse_weights("foo@umb.edu:2, bar@usgs.gov:0.5"),
+                         {"foo@umb.edu": 2.0, "bar@usgs.gov": 0.5})
+
+    def test_start_finish(self):
+        self.fair.start("espa-big@usgs.gov-1", 4)
+        self.fair.start("espa-big@usgs.gov-2")
+        self.fair.start("espa-foo@umb.edu-1")
+        self.assertEqual(self.fair.shares(), {"big@usgs.gov": {"running": 5, "share": 2.5},
+                                              "foo@umb.edu": {"running": 1, "share": 1.0}})
+
+        self.fair.finish("espa-big@usgs.gov-1", 4)
+        self.assertEqual(self.fair.orders, {"espa-big@usgs.gov-2": 1, "espa-foo@umb.edu-1": 1})
+        self.fair.finish("espa-foo@umb.edu-1")
+        self.assertEqual(self.fair.users, {"big@usgs.gov": 1})
+
+    def test_rank(self):
+        self.fair.start("espa-big@usgs.gov-1", 2)
+        self.fair.start("espa-foo@umb.edu-1", 1)
+        # big's weight of 2 makes its 2 units the same share as foo's 1, foo's order has fewer running
+        self.assertLess(self.fair.rank("espa-big@usgs.gov-2"), self.fair.rank("espa-foo@umb.edu-1"))
+        self.assertLess(self.fair.rank("espa-foo@umb.edu-1"), self.fair.rank("espa-big@usgs.gov-1"))
+        self.assertEqual(self.fair.rank("espa-new@umb.edu-1"), (0, 0))
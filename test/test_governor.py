@@ -0,0 +1,78 @@
+import unittest
+
+from scheduler import governor
+
+class TestGovernor(unittest.TestCase):
+    def setUp(self):
+        self.governor = governor.CpuGovernor(10, 10, 40, step=2, hold_seconds=300,
+                                             peak=governor.peak_hours('8-18'), peak_ceiling=20)
+
+    def test_peak_hours(self):
+        self.assertEqual(governor.peak_hours('8-11'), {8, 9, 10})
+        self.assertEqual(governor.peak_hours('22-2'), {22, 23, 0, 1})
+        self.assertEqual(governor.peak_hours(None), set())
+
+    def test_enabled(self):
+        self.assertTrue(self.governor.enabled)
+        self.assertFalse(governor.CpuGovernor(10, 10, 10).enabled)
+
+    def test_grows_with_backlog_and_spare_capacity(self):
+        self.governor.observe_offers({'a1': 30}, now=0)
+        self.governor.observe_fetch('landsat', 50, 50)
+        cap, explanation = self.governor.adjust(10, 20, 1, now=0, hour=2)
+        self.assertEqual(cap, 40)
+        self.assertIn("max cpu 10 -> 40", explanation)
+        self.assertIn("landsat", explanation)
+
+    def test_limited_by_spare_capacity(self):
+        self.governor.observe_offers({'a1': 5}, now=0)
+        cap, _ = self.governor.adjust(10, 100, 1, now=0, hour=2)
+        self.assertEqual(cap, 15)
+
+    def test_hysteresis(self):
+        self.governor.observe_offers({'a1': 30}, now=0)
+        self.governor.adjust(10, 10, 1, now=0, hour=2)
+        self.assertEqual(self.governor.cap, 20)
+
+        # within hold time
+        cap, explanation = self.governor.adjust(10, 30, 1, now=100, hour=2)
+        self.assertEqual(cap, 20)
+        self.assertIsNone(explanation)
+
+        # within the band, with the agent still offering
+        self.governor.observe_offers({'a1': 30}, now=400)
+        cap, explanation = self.governor.adjust(10, 11, 1, now=400, hour=2)
+        self.assertEqual(cap, 20)
+        self.assertIsNone(explanation)
+
+        cap, explanation = self.governor.adjust(10, 30, 1, now=400, hour=2)
+        self.assertEqual(cap, 40)
+
+    def test_peak_ceiling(self):
+        self.governor.observe_offers({'a1': 100}, now=0)
+        self.governor.adjust(10, 100, 1, now=0, hour=2)
+        self.assertEqual(self.governor.cap, 40)
+
+        # the lower peak ceiling applies right away
+        cap, explanation = self.governor.adjust(10, 100, 1, now=1, hour=9)
+        self.assertEqual(cap, 20)
+        self.assertIn("peak ceiling 20", explanation)
+
+    def test_spare_per_agent(self):
+        # each agent's latest offer counts once, however often it offers
+        for now in range(10):
+            self.governor.observe_offers({'a1': 8}, now=now)
+        self.governor.observe_offers({'a2': 4, 'a3': 6}, now=10)
+        self.assertEqual(self.governor.spare(now=10), 18)
+
+        # a smaller offer replaces the agent's last one
+        self.governor.observe_offers({'a1': 2}, now=20)
+        self.assertEqual(self.governor.spare(now=20), 12)
+
+        # agents that stop offering drop out after the window
+        self.assertEqual(self.governor.spare(now=311), 2)
+        self.assertEqual(self.governor.spare(now=321), 0)
+
+    def test_floor(self):
+        cap, _ = self.governor.adjust(0, 0, 1, now=0, hour=2)
+        self.assertEqual(cap, 10)
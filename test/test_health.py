@@ -0,0 +1,33 @@
+import unittest
+
+from scheduler import health
+
+class TestHealth(unittest.TestCase):
+    def setUp(self):
+        self.agents = health.AgentHealth(600, 3, 0.5, 100)
+
+    def test_quarantine(self):
+        self.assertFalse(self.agents.record_failure("a1", now=0))
+        self.assertFalse(self.agents.record_failure("a1", now=1))
+        self.assertTrue(self.agents.record_failure("a1", now=2))
+        self.assertTrue(self.agents.is_excluded("a1", now=50))
+        self.assertEqual(self.agents.exclusions(now=50), {"a1": {"remaining_seconds": 52, "quarantines": 1}})
+        self.assertFalse(self.agents.is_excluded("a1", now=103))
+
+    def test_quarantine_grows(self):
+        for i in range(3):
+            self.agents.record_failure("a1", now=i)
+        for i in range(3):
+            self.agents.record_failure("a1", now=200 + i)
+        self.assertEqual(self.agents.remaining("a1", now=202), 200)
+
+    def test_failure_rate(self):
+        for i in range(10):
+            self.agents.record_success("a1", now=i)
+        for i in range(3):
+            self.assertFalse(self.agents.record_failure("a1", now=10 + i))
+
+    def test_window(self):
+        self.agents.record_failure("a1", now=0)
+        self.agents.record_failure("a1", now=1)
+        self.assertFalse(self.agents.record_failure("a1", now=700))
@@ -0,0 +1,75 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from scheduler import lifecycle
+
+class TestLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.tracker = lifecycle.Lifecycle(max_units=10, trace_size=2)
+
+    def run_unit(self, scene, product_type, start, final=lifecycle.FINISHED):
+        key = ("o1", scene)
+        self.tracker.mark(key, lifecycle.FETCHED, product_type, now=start)
+        self.tracker.mark(key, lifecycle.SCHEDULED, now=start + 1)
+        self.tracker.mark(key, lifecycle.TASKED, now=start + 11)
+        self.tracker.mark(key, lifecycle.STAGING, now=start + 12)
+        self.tracker.mark(key, lifecycle.RUNNING, now=start + 42)
+        self.tracker.mark(key, final, now=start + 142)
+
+    def test_summary(self):
+        self.run_unit("s1", "landsat", 0)
+        self.run_unit("s2", "landsat", 5)
+        self.run_unit("s3", "modis", 5, lifecycle.FAILED)
+
+        summary = self.tracker.summary()
+        self.assertEqual(summary["landsat"]["tasked"], {"count": 2, "p50": 10, "p95": 10, "p99": 10})
+        self.assertEqual(summary["landsat"]["running"]["p99"], 30)
+        self.assertEqual(summary["landsat"]["total"]["count"], 2)
+        self.assertEqual(summary["modis"]["failed"]["p50"], 100)
+        self.assertNotIn("finished", summary["modis"])
+        self.assertEqual(self.tracker.in_flight(), 0)
+
+    def test_in_flight(self):
+        for i in range(12):
+            self.tracker.mark(("o1", "s{}".format(i)), lifecycle.FETCHED, "plot", now=i)
+        self.assertEqual(self.tracker.in_flight(), 10)
+        self.assertNotIn(("o1", "s0"), self.tracker.units)
+
+    def test_export(self):
+        for i in range(3):
+            self.run_unit("s{}".format(i), "viirs", i)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.csv")
+            self.assertEqual(self.tracker.export(path), 2)
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual([r["scene"] for r in rows], ["s1", "s2"])
+            self.assertEqual(float(rows[0]["running"]), 42)
+            self.assertEqual(rows[0]["failed"], "")
+
+            path = os.path.join(tmp, "trace.json")
+            self.tracker.export(path)
+            with open(path) as f:
+                rows = json.load(f)
+            self.assertEqual(rows[1]["finished"], 142)
+            self.assertIsNone(rows[1]["failed"])
+
+    def test_out_of_order(self):
+        # the Mesos thread can launch a unit before the event loop records it as scheduled
+        key = ("o1", "s1")
+        self.tracker.mark(key, lifecycle.FETCHED, "landsat", now=0)
+        self.assertTrue(self.tracker.mark(key, lifecycle.TASKED, now=2))
+        self.assertFalse(self.tracker.mark(key, lifecycle.SCHEDULED, now=3))
+        self.assertFalse(self.tracker.mark(key, lifecycle.TASKED, now=4))
+        self.assertNotIn("scheduled", self.tracker.summary()["landsat"])
+
+        # a requeued unit goes back to scheduled, and through the stages again
+        self.assertTrue(self.tracker.mark(key, lifecycle.SCHEDULED, now=10, rewind=True))
+        self.assertTrue(self.tracker.mark(key, lifecycle.TASKED, now=15))
+        self.tracker.mark(key, lifecycle.FINISHED, now=20)
+        self.assertEqual(self.tracker.summary()["landsat"]["tasked"]["count"], 2)
+        self.assertEqual(self.tracker.trace[-1]["tasked"], 15)
@@ -3,14 +3,19 @@ import os
 import re
 import requests
 import requests_mock
+import subprocess
+import sys
+import threading
 import unittest
 
 from addict import Dict
 from mock import patch
 from unittest.mock import Mock
-from multiprocessing import Queue
+from queue import Queue
 
+from scheduler import lifecycle
 from scheduler.main import ESPAFramework
+from scheduler.queues import LaneQueue
 from scheduler.config import config
 from scheduler.espa import api_connect
 
@@ -29,6 +34,12 @@ class TestMain(unittest.TestCase):
         self.api = api_connect({"espa_api": self.host, "task_image": self.image})
         self.framework = ESPAFramework(self.cfg, self.api, worklist)
 
+    def test_import_side_effects(self):
+        # importing configures no logging and makes no calls, main() does that
+        code = "import logging, scheduler.main; assert not logging.getLogger('scheduler').handlers"
+        env = dict(os.environ, ESPA_API="http://localhost:1", PYTHONPATH=os.getcwd())
+        subprocess.run([sys.executable, "-c", code], env=env, check=True, timeout=30)
+
     def test__getResource(self):
         resource = Dict()
         resource.name = "cpus"
@@ -88,16 +99,38 @@ class TestMain(unittest.TestCase):
         resp = self.framework.offer_received(offers)
         self.assertFalse(resp.tasks.enabled)
 
+    @patch('scheduler.espa.APIServer.available', lambda i: False)
+    def test_offer_received_api_unavailable(self):
+        offers = [Mock()]
+        resp = self.framework.offer_received(offers)
+        self.assertFalse(resp.tasks.enabled)
+        offers[0].decline.assert_called_once()
+
     @patch('scheduler.espa.APIServer.mesos_tasks_disabled', lambda i: False)
     @patch('scheduler.espa.APIServer.get_products_to_process', lambda a, b, c: {"products": []})
     @patch('scheduler.main.ESPAFramework.accept_offer', lambda a, b: True)
     def test_offer_received_nowork(self):
         driver = Mock()
-        offers = [Mock()]
+        offer = Mock()
+        offer.get_offer.return_value = {'agent_id': {'value': 'foo'}}
+        offers = [offer]
 
         resp = self.framework.offer_received(offers)
         self.assertTrue(resp.tasks.enabled)
 
+    @patch('scheduler.espa.APIServer.mesos_tasks_disabled', lambda i: False)
+    def test_offer_received_spare(self):
+        def offer(agent_id, cpus):
+            o = Mock()
+            o.get_offer.return_value = {'agent_id': {'value': agent_id},
+                                        'resources': [{'name': 'cpus', 'scalar': {'value': cpus}}]}
+            return o
+
+        self.framework.offer_received([offer('a1', 4), offer('a1', 2), offer('a2', 8)])
+        self.framework.offer_received([offer('a2', 6)])
+        # an agent's offers in a batch add up, its next batch replaces them
+        self.assertEqual(self.framework.governor.spare(), 12)
+
     @patch('scheduler.espa.APIServer.mesos_tasks_disabled', lambda i: False)
     @patch('scheduler.espa.APIServer.get_products_to_process', lambda a, b, c: {"products": [{"orderid": "foo@manchu.com-123", "sceneid": "L8BBCC"}, {"orderid": "foo@manchu.com-123", "sceneid": "L7BBCC"}]})
     @patch('scheduler.espa.APIServer.set_to_scheduled', lambda a, b: True)
@@ -118,6 +151,7 @@ class TestMain(unittest.TestCase):
         disk_resource_good.scalar.value = 10240
         offer_good = Mock()
         offer_good.resources = [cpu_resource_good, mem_resource_good, disk_resource_good]
+        offer_good.get_offer.return_value = {'agent_id': {'value': 'foo'}}
 
         offers = [offer_good]
 
@@ -133,6 +167,11 @@ class TestMain(unittest.TestCase):
         resp = self.framework.offer_received(offers)
         self.assertTrue(resp.tasks.enabled)
         self.assertEqual(resp.offers.accepted, 1)
+        self.assertEqual(self.framework.fair.orders, {"foo": 1})
+
+        update = {'status': {'task_id': {'value': "foo_@@@_bar"}, 'state': "TASK_FINISHED"}}
+        self.framework.status_update(update)
+        self.assertEqual(self.framework.fair.orders, {})
 
 
     def test_status_update(self):
@@ -149,3 +188,235 @@ class TestMain(unittest.TestCase):
         self.assertEqual(resp['state'], update['status']['state'])
         self.assertEqual(resp['list']['name'], "running")
         self.assertEqual(resp['list']['status'], "new")
+        self.assertEqual(self.framework.index.state(("orderid", "unitid")), "running")
+
+        self.framework.on_units_done = Mock()
+        update['status']['state'] = "TASK_FINISHED"
+        self.framework.status_update(update)
+        self.assertEqual(self.framework.index.state(("orderid", "unitid")), "finished")
+        self.framework.on_units_done.assert_called_once_with("orderid", 1, True)
+        self.assertFalse(self.framework.index.add({"orderid": "orderid", "scene": "unitid"}))
+        self.assertEqual(self.framework.lifecycle.trace[-1]["scene"], "unitid")
+
+    @patch('scheduler.espa.APIServer.update_status', lambda a, b, c, d: True)
+    def test_status_update_retry(self):
+        work = {"orderid": "orderid", "scene": "unitid"}
+        self.framework.taskedList["orderid_@@@_unitid"] = [work]
+        self.framework.retries.backoff = 0
+        self.framework.lifecycle.mark(("orderid", "unitid"), lifecycle.TASKED)
+
+        update = dict()
+        update['status'] = {'task_id': {'value': "orderid_@@@_unitid"}, 'state': "TASK_LOST"}
+
+        resp = self.framework.status_update(update)
+
+        self.assertEqual(resp['status'], "retrying")
+        # a requeued unit goes back to scheduled, though it was tasked before
+        self.assertEqual(list(self.framework.lifecycle.units[("orderid", "unitid")]["stages"])[-1], "scheduled")
+        self.assertEqual(self.framework._next_work(), work)
+        self.assertNotIn("orderid_@@@_unitid", self.framework.taskedList)
+
+    @patch('scheduler.espa.APIServer.update_status', lambda a, b, c, d: True)
+    def test_status_update_stale_attempt(self):
+        work = {"orderid": "orderid", "scene": "unitid"}
+        self.framework.taskedList["orderid_@@@_unitid"] = [work]
+        self.framework.retries.backoff = 0
+        lost = {'status': {'task_id': {'value': "orderid_@@@_unitid"}, 'state': "TASK_LOST"}}
+        self.assertEqual(self.framework.status_update(lost)['status'], "retrying")
+
+        # a repeated update for the first launch neither requeues the unit again nor adopts it
+        self.assertEqual(self.framework.status_update(lost)['status'], "stale")
+        running = {'status': {'task_id': {'value': "orderid_@@@_unitid"}, 'state': "TASK_RUNNING"}}
+        self.assertEqual(self.framework.status_update(running)['status'], "stale")
+        self.assertEqual(len(self.framework.retryList), 1)
+        self.assertEqual(self.framework.retries.attempts[("orderid", "unitid")], 1)
+        self.assertEqual(self.framework.taskedList, {})
+        self.assertEqual(self.framework.runningList, {})
+        self.assertEqual(self.framework.fair.orders, {})
+
+        # the relaunch carries the attempt in its id
+        running['status']['task_id']['value'] = "orderid_@@@_unitid_###_1"
+        self.assertEqual(self.framework.status_update(running)['status'], "healthy")
+        self.assertIn("orderid_@@@_unitid_###_1", self.framework.runningList)
+
+    @patch('scheduler.main.requests.post')
+    def test_subscribed_reconcile(self, post):
+        driver = Mock(frameworkId="fw-1", streamId="stream-1", mesos_url="http://master:5050")
+        self.framework.subscribed(driver)
+        post.assert_not_called()
+
+        # a framework taking over an id asks Mesos for its running tasks
+        self.framework.framework_id = "fw-1"
+        self.framework.subscribed(driver)
+        url, body = post.call_args[0]
+        self.assertEqual(url, "http://master:5050/api/v1/scheduler")
+        self.assertEqual(json.loads(body), {"framework_id": {"value": "fw-1"}, "type": "RECONCILE",
+                                            "reconcile": {"tasks": []}})
+        self.assertEqual(post.call_args[1]['headers']['Mesos-Stream-Id'], "stream-1")
+
+        update = {'status': {'task_id': {'value': "o1_@@@_s1_+++_s2"}, 'state': "TASK_RUNNING",
+                             'reason': "REASON_RECONCILIATION"}}
+        self.framework.status_update(update)
+        self.assertEqual([u["scene"] for u in self.framework.taskedList["o1_@@@_s1_+++_s2"]], ["s1", "s2"])
+        self.assertIn("o1_@@@_s1_+++_s2", self.framework.runningList)
+        self.assertEqual(self.framework.index.open_units("o1"), 2)
+        self.assertEqual(self.framework.fair.orders, {"o1": 2})
+
+    def test_status_update_retry_draining(self):
+        work = {"orderid": "orderid", "scene": "unitid"}
+        self.framework.taskedList["orderid_@@@_unitid"] = [work]
+        self.framework.espa.update_status = Mock()
+        self.framework.draining = True
+
+        update = {'status': {'task_id': {'value': "orderid_@@@_unitid"}, 'state': "TASK_LOST"}}
+        resp = self.framework.status_update(update)
+
+        self.assertEqual(resp['status'], "retrying")
+        self.framework.espa.update_status.assert_called_once_with("unitid", "orderid", "submitted")
+        self.assertEqual(len(self.framework.retryList), 0)
+
+        # offers are declined while draining
+        offer = Mock()
+        self.assertFalse(self.framework.offer_received([offer]).tasks.enabled)
+        offer.decline.assert_called_once()
+
+    def test_take_queued(self):
+        self.framework.workList.put_nowait({"orderid": "o1", "scene": "s1"})
+        self.framework.retryList.append((0, {"orderid": "o1", "scene": "s2"}))
+        self.assertEqual([u["scene"] for u in self.framework.take_queued()], ["s2", "s1"])
+        self.assertTrue(self.framework.workList.empty())
+        self.assertEqual(len(self.framework.retryList), 0)
+
+    def test_take_queued_concurrent(self):
+        # units put back on the Mesos thread while a drain takes the queue are never lost
+        units = [{"orderid": "o1", "scene": "s{}".format(i)} for i in range(2000)]
+        putter = threading.Thread(target=lambda: [self.framework._put_back([u]) for u in units])
+        taken = []
+        putter.start()
+        while putter.is_alive():
+            taken.extend(self.framework.take_queued())
+        putter.join()
+        taken.extend(self.framework.take_queued())
+        self.assertEqual(sorted(u["scene"] for u in taken), sorted(u["scene"] for u in units))
+
+    def test_status_update_error(self):
+        self.framework.taskedList["orderid_@@@_unitid"] = [{"orderid": "orderid", "scene": "unitid"}]
+        self.framework.espa.set_scene_error = Mock()
+
+        update = dict()
+        update['status'] = {'task_id': {'value': "orderid_@@@_unitid"}, 'state': "TASK_FAILED"}
+
+        resp = self.framework.status_update(update)
+
+        self.assertEqual(resp['status'], "unhealthy")
+        self.framework.espa.set_scene_error.assert_called_once_with("unitid", "orderid", update)
+        self.assertEqual(len(self.framework.retryList), 0)
+
+    def test_status_update_not_agent_fault(self):
+        # a master failover loses tasks on healthy agents, which aren't quarantined for it
+        self.framework.espa.set_scene_error = Mock()
+        self.framework.agents.max_failures = 2
+        for i in range(3):
+            update = {'status': {'task_id': {'value': "orderid_@@@_s{}".format(i)}, 'state': "TASK_LOST",
+                                 'reason': "REASON_MASTER_DISCONNECTED", 'agent_id': {'value': 'good-agent'}}}
+            self.framework.status_update(update)
+        self.assertEqual(self.framework.agent_exclusions(), {})
+
+    @patch('scheduler.espa.APIServer.mesos_tasks_disabled', lambda i: False)
+    def test_offer_received_quarantined(self):
+        self.framework.espa.set_scene_error = Mock()
+        self.framework.agents.max_failures = 2
+        update = dict()
+        update['status'] = {'task_id': {'value': "orderid_@@@_unitid"}, 'state': "TASK_FAILED",
+                            'agent_id': {'value': 'bad-agent'}}
+        self.framework.status_update(update)
+        self.framework.status_update(update)
+        self.assertIn('bad-agent', self.framework.agent_exclusions())
+
+        offer = Mock()
+        offer.get_offer.return_value = {'agent_id': {'value': 'bad-agent'}}
+        resp = self.framework.offer_received([offer])
+        self.assertEqual(resp.offers.quarantined, 1)
+        self.assertEqual(resp.offers.accepted, 0)
+        refuse = offer.decline.call_args[0][0]['filters']['refuse_seconds']
+        self.assertGreater(refuse, self.framework.refuse_seconds)
+
+    def test__batch(self):
+        framework = self.framework
+        framework.batch_size = 3
+        framework.required_disk = 100
+        plot = lambda o, s: {"orderid": o, "scene": s, "product_type": "plot"}
+        framework.workList = Queue()
+        for unit in [plot("o1", "s2"), plot("o2", "s3"), plot("o1", "s4"), plot("o1", "s5")]:
+            framework.workList.put(unit)
+        disk = Dict()
+        disk.name = "disk"
+        disk.scalar.value = 500
+
+        units = framework._batch(plot("o1", "s1"), {'resources': [disk]})
+
+        self.assertEqual([u['scene'] for u in units], ["s1", "s2", "s4"])
+        self.assertEqual(disk.scalar.value, 300)
+        self.assertEqual(framework._next_work()['scene'], "s3")
+        self.assertEqual(framework._next_work()['scene'], "s5")
+
+    def test__batch_priority(self):
+        framework = self.framework
+        framework.batch_size = 2
+        framework.required_disk = 100
+        framework.workList = LaneQueue()
+        for i in range(8):
+            framework.workList.put({"orderid": "o2", "scene": "n{}".format(i), "product_type": "landsat"})
+        disk = Dict()
+        disk.name = "disk"
+        disk.scalar.value = 500
+
+        units = framework._batch({"orderid": "o1", "scene": "p1", "product_type": "plot"}, {'resources': [disk]})
+        framework.workList.put({"orderid": "o3", "scene": "h1", "priority": "high"})
+
+        # skipped units go back to their lane, behind a high priority unit queued afterwards
+        self.assertEqual([u['scene'] for u in units], ["p1"])
+        self.assertEqual(len(framework.retryList), 0)
+        self.assertEqual([framework._next_work()['scene'] for _ in range(3)], ["h1", "n0", "n1"])
+
+    def test__batch_disabled(self):
+        work = {"orderid": "o1", "scene": "s1", "product_type": "landsat"}
+        self.framework.batch_size = 3
+        self.assertEqual(self.framework._batch(work, {}), [work])
+
+    def test_status_update_batch(self):
+        self.framework.espa.set_scene_error = Mock()
+        update = dict()
+        update['status'] = {'task_id': {'value': "orderid_@@@_s1_+++_s2"}, 'state': "TASK_FAILED"}
+
+        resp = self.framework.status_update(update)
+
+        self.assertEqual(resp['status'], "unhealthy")
+        self.assertEqual(self.framework.espa.set_scene_error.call_count, 2)
+        self.framework.espa.set_scene_error.assert_called_with("s2", "orderid", update)
+
+    def test_reconfigure(self):
+        products = self.framework.products
+        cfg = dict(self.cfg)
+        cfg['max_cpu'] = 42
+        cfg['task_retry_max'] = 7
+        cfg['product_frequency'] = ['landsat', 'plot']
+        self.framework.reconfigure(cfg)
+        self.assertEqual(self.framework.max_cpus, 42)
+        self.assertEqual(self.framework.retries.max_retries, 7)
+        self.assertIs(self.framework.products, products)
+        self.assertEqual(products, ['landsat', 'plot'])
+
+    def test_govern(self):
+        framework = self.framework
+        self.assertEqual(framework.govern(), framework.max_cpus)
+
+        cfg = dict(self.cfg)
+        cfg['max_cpu_ceiling'] = 30
+        framework.reconfigure(cfg)
+        framework.governor.observe_offers({'a1': 30, 'a2': 20})
+        for i in range(25):
+            framework.retryList.append((0, {"orderid": "o1", "scene": str(i)}))
+        self.assertEqual(framework.govern(), 25)
+        self.assertEqual(framework.max_cpus, 25)
+        framework.retryList.clear()
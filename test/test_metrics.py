@@ -0,0 +1,15 @@
+import unittest
+
+from scheduler import metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def test_summary(self):
+        summary = metrics.Summary(size=100)
+        self.assertIsNone(summary.quantile(0.5))
+        for i in range(1, 201):
+            summary.observe(i)
+        snap = summary.snapshot()
+        self.assertEqual(snap["count"], 200)
+        self.assertEqual(snap["p50"], 150)
+        self.assertEqual(snap["p99"], 199)
@@ -0,0 +1,50 @@
+import unittest
+
+from unittest.mock import Mock
+
+from scheduler import placement
+
+def mock_offer(agent_id):
+    offer = Mock()
+    offer.get_offer.return_value = {'agent_id': {'value': agent_id}}
+    return offer
+
+class TestPlacement(unittest.TestCase):
+    def setUp(self):
+        self.image  = "usgseros/espa-worker:latest"
+        self.scorer = placement.PlacementScorer(3600, 10)
+
+    def test_score(self):
+        self.assertEqual(self.scorer.score("a1", self.image, "landsat"), placement.COLD)
+        self.scorer.launched("t1", "a1", self.image, "landsat", False)
+        self.assertEqual(self.scorer.score("a1", self.image, "landsat"), placement.WARM_PRODUCT)
+        self.assertEqual(self.scorer.score("a1", self.image, "modis"), placement.WARM_IMAGE)
+        self.assertEqual(self.scorer.score("a1", "other:latest", "landsat"), placement.COLD)
+
+    def test_choose_prefers_warm(self):
+        self.scorer.launched("t1", "warm", self.image, "landsat", False)
+        cold, warm = mock_offer("cold"), mock_offer("warm")
+        offer, is_warm = self.scorer.choose([cold, warm], self.image, "landsat")
+        self.assertIs(offer, warm)
+        self.assertTrue(is_warm)
+
+    def test_choose_holds_cold_briefly(self):
+        self.scorer.launched("t1", "warm", self.image, "landsat", False)
+        cold = mock_offer("cold")
+        offer, _ = self.scorer.choose([cold], self.image, "landsat", now=self.scorer.launches["t1"][0])
+        self.assertIsNone(offer)
+        offer, is_warm = self.scorer.choose([cold], self.image, "landsat", now=self.scorer.launches["t1"][0] + 11)
+        self.assertIs(offer, cold)
+        self.assertFalse(is_warm)
+
+    def test_choose_no_warm_agents(self):
+        cold = mock_offer("cold")
+        offer, is_warm = self.scorer.choose([cold], self.image, "landsat")
+        self.assertIs(offer, cold)
+
+    def test_running(self):
+        self.scorer.launched("t1", "a1", self.image, "landsat", True)
+        placement_name, seconds = self.scorer.running("t1")
+        self.assertEqual(placement_name, "warm")
+        self.assertEqual(self.scorer.latency_summary()["warm"]["count"], 1)
+        self.assertIsNone(self.scorer.running("t1"))
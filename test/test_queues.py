@@ -0,0 +1,105 @@
+import unittest
+
+from queue import Empty
+
+from scheduler import fairshare, queues
+
+def unit(scene, priority=None, orderid="o1"):
+    return {"orderid": orderid, "scene": scene, "priority": priority}
+
+class TestQueues(unittest.TestCase):
+    def setUp(self):
+        self.queue = queues.LaneQueue(starvation_seconds=600)
+
+    def test_lane(self):
+        self.assertEqual(queues.lane(unit("s1", "high")), "high")
+        self.assertEqual(queues.lane(unit("s1", "Low")), "low")
+        self.assertEqual(queues.lane(unit("s1")), "normal")
+        self.assertEqual(queues.lane(unit("s1", "urgent")), "normal")
+
+    def test_priority_order(self):
+        for i in range(3):
+            self.queue.put_nowait(unit("bulk{}".format(i), "normal"), now=0)
+        self.queue.put_nowait(unit("later", "low"), now=0)
+        self.queue.put_nowait(unit("urgent", "high"), now=1)
+        self.assertEqual(self.queue.qsize(), 5)
+
+        self.assertEqual(self.queue.get(now=2)["scene"], "urgent")
+        self.assertEqual(self.queue.get(now=2)["scene"], "bulk0")
+        stats = self.queue.stats()
+        self.assertEqual(stats["high"]["wait"]["p50"], 1)
+        self.assertEqual(stats["normal"]["queued"], 2)
+
+    def test_starvation(self):
+        self.queue.put_nowait(unit("old", "low"), now=0)
+        self.queue.put_nowait(unit("new", "high"), now=500)
+        self.assertEqual(self.queue.get(now=550)["scene"], "new")
+        self.queue.put_nowait(unit("newer", "high"), now=600)
+        self.assertEqual(self.queue.get(now=700)["scene"], "old")
+
+    def test_starvation_every_lane(self):
+        # under sustained load every lane starves, the longest waiting unit goes first, higher lanes on a tie
+        self.queue.put_nowait(unit("low0", "low"), now=0)
+        self.queue.put_nowait(unit("high0", "high"), now=0)
+        self.queue.put_nowait(unit("normal1", "normal"), now=1)
+        self.queue.put_nowait(unit("low2", "low"), now=2)
+        self.assertEqual([self.queue.get(now=1000)["scene"] for _ in range(4)], ["high0", "low0", "normal1", "low2"])
+
+    def test_empty(self):
+        self.assertTrue(self.queue.empty())
+        with self.assertRaises(Empty):
+            self.queue.get(False)
+
+    def test_fifo_across_orders(self):
+        self.queue.put_nowait(unit("a1", orderid="a"), now=0)
+        self.queue.put_nowait(unit("b1", orderid="b"), now=1)
+        self.queue.put_nowait(unit("a2", orderid="a"), now=2)
+        self.assertEqual([self.queue.get(now=3)["scene"] for _ in range(3)], ["a1", "b1", "a2"])
+        self.assertEqual(self.queue.stats()["normal"]["orders"], 0)
+
+    def test_fair_share(self):
+        fair = fairshare.FairShare()
+        self.queue.fair = fair
+        for i in range(10):
+            self.queue.put_nowait(unit("big{}".format(i), orderid="espa-big@usgs.gov-1"), now=0)
+        self.queue.put_nowait(unit("small0", orderid="espa-foo@umb.edu-1"), now=1)
+        fair.start("espa-big@usgs.gov-1", 3)
+
+        # big already holds slots, so the small order goes next even though it arrived later
+        self.assertEqual(self.queue.get(now=2)["scene"], "small0")
+        self.assertEqual(self.queue.get(now=2)["scene"], "big0")
+
+    def test_fair_share_small_order_latency(self):
+        # 4 slots, tasks take 10 ticks, a 1000 unit order is queued before a 5 unit order from another user
+        fair = fairshare.FairShare()
+        self.queue.fair = fair
+        for i in range(1000):
+            self.queue.put_nowait(unit("big{}".format(i), orderid="espa-big@usgs.gov-1"), now=0)
+        for i in range(5):
+            self.queue.put_nowait(unit("small{}".format(i), orderid="espa-foo@umb.edu-1"), now=1)
+
+        running = []
+        finished = {}
+        for now in range(2, 200):
+            for started, u in [r for r in running if now - r[0] >= 10]:
+                running.remove((started, u))
+                fair.finish(u["orderid"])
+                finished[u["scene"]] = now
+            while len(running) < 4 and not self.queue.empty():
+                u = self.queue.get(now=now)
+                fair.start(u["orderid"])
+                running.append((now, u))
+
+        # the small order gets half the slots, instead of waiting for the big order to drain
+        self.assertTrue(all(finished["small{}".format(i)] <= 32 for i in range(5)))
+        self.assertLessEqual(max(fair.users.values()), 4)
+
+    def test_requeue(self):
+        self.queue.put_nowait(unit("s1", "low"), now=0)
+        self.queue.put_nowait(unit("s2", "low"), now=1)
+        taken = self.queue.get(now=5)
+        self.queue.requeue(taken, now=700)
+        # back at the front of its lane, still starving from its first queue time
+        self.queue.put_nowait(unit("h1", "high"), now=700)
+        self.assertEqual(self.queue.get(now=700)["scene"], "s1")
+        self.assertEqual(self.queue.stats()["low"]["wait"]["count"], 1)
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from collections import deque
+from queue import Queue
+from unittest.mock import Mock
+
+from scheduler.config import config
+from scheduler.dedup import UnitIndex
+from scheduler.lifecycle import Lifecycle
+from scheduler.main import ESPAFramework
+from scheduler.placement import PlacementScorer
+from scheduler.runtime import Runtime
+from scheduler.util import TokenBucket
+
+class MockClient(object):
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def register(self):
+        self.stopped.wait(5)
+        return False
+
+    def tearDown(self):
+        self.stopped.set()
+
+class SlowClient(MockClient):
+    def register(self):
+        self.registered_at = time.monotonic()
+        return super().register()
+
+def slow_api():
+    """ESPA API that takes its time, like one under load"""
+    def products(product_types, limit, priority=None):
+        time.sleep(0.3)
+        return {"products": [{"orderid": "o1", "scene": "s{}".format(i)} for i in range(limit)]}
+
+    api = Mock()
+    api.mesos_tasks_enabled.return_value = True
+    api.get_products_to_process.side_effect = products
+    api.set_to_scheduled.side_effect = lambda unit: time.sleep(0.05)
+    return api
+
+class TestRuntime(unittest.TestCase):
+    def setUp(self):
+        self.cfg = config()
+        self.framework = Mock()
+        self.framework.workList = Queue()
+        self.framework.products = ['landsat', 'modis']
+        self.framework.client = MockClient()
+        self.framework.index = UnitIndex(60, 1000)
+        self.framework.lifecycle = Lifecycle()
+        self.framework.placement = PlacementScorer(600, 30)
+        self.framework.retryList = deque()
+        self.framework.taskedList = {}
+        self.framework.lock = threading.RLock()
+        self.framework.take_queued.side_effect = lambda: ESPAFramework.take_queued(self.framework)
+
+        self.espa = Mock()
+        self.espa.mesos_tasks_enabled.return_value = True
+        self.espa.get_products_to_process.return_value = {"products": [{"orderid": "o1", "scene": "s1"},
+                                                                       {"orderid": "o1", "scene": "s2"}]}
+        self.runtime = Runtime(self.cfg, self.espa, self.framework)
+
+    def test_fetch(self):
+        queued = asyncio.run(self.runtime.fetch())
+        self.assertEqual(queued, 2)
+        self.assertEqual(self.framework.workList.qsize(), 2)
+        self.assertEqual(self.espa.set_to_scheduled.call_count, 2)
+        self.espa.get_products_to_process.assert_called_once_with(['landsat'], self.cfg.get('product_request_count'))
+        self.assertEqual(self.framework.products, ['modis', 'landsat'])
+        self.assertEqual(self.framework.lifecycle.in_flight(), 2)
+        self.assertEqual(self.framework.lifecycle.summary()["unknown"]["scheduled"]["count"], 2)
+
+    def test_fetch_launched_early(self):
+        # the Mesos thread takes and launches each unit as soon as it's queued
+        lifecycle = self.framework.lifecycle
+        espa = self.espa
+        class Launching(Queue):
+            def put_nowait(self, unit):
+                super().put_nowait(unit)
+                espa.update_status(unit["scene"], unit["orderid"], "tasked")
+                lifecycle.mark((unit["orderid"], unit["scene"]), "tasked")
+        self.framework.workList = Launching()
+
+        asyncio.run(self.runtime.fetch())
+        # every unit was confirmed 'scheduled' in ESPA before the first one was launched
+        self.assertEqual([c[0] for c in espa.method_calls if c[0] in ('set_to_scheduled', 'update_status')],
+                         ['set_to_scheduled', 'set_to_scheduled', 'update_status', 'update_status'])
+        stages = lifecycle.units[("o1", "s1")]["stages"]
+        self.assertEqual(list(stages), ["fetched", "scheduled", "tasked"])
+
+    def test_fetch_duplicates(self):
+        asyncio.run(self.runtime.fetch())
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 0)
+        self.assertEqual(self.framework.workList.qsize(), 2)
+        self.assertEqual(self.espa.set_to_scheduled.call_count, 2)
+        self.assertEqual(self.framework.index.metrics()["dropped"], {"queued": 2})
+
+    def test_report(self):
+        self.espa.deferred = {}
+        asyncio.run(self.runtime.fetch())
+        self.framework.lifecycle.mark(("o1", "s1"), "finished")
+        with tempfile.TemporaryDirectory() as tmp:
+            cfg = dict(self.cfg)
+            cfg['lifecycle_trace_file'] = os.path.join(tmp, 'trace.json')
+            self.runtime.cfg = cfg
+            asyncio.run(self.runtime.report())
+            with open(cfg['lifecycle_trace_file']) as f:
+                trace = json.load(f)
+        self.assertEqual([(row["orderid"], row["scene"]) for row in trace], [("o1", "s1")])
+        self.espa.breaker.metrics.assert_called_once()
+
+    def test_report_placement(self):
+        self.espa.deferred = {}
+        placement = self.framework.placement
+        placement.launched("t1", "a1", "image", "landsat", True)
+        placement.running("t1")
+        with self.assertLogs('scheduler', level='INFO') as logs:
+            asyncio.run(self.runtime.report())
+        line = next(l for l in logs.output if "by placement" in l)
+        self.assertIn("'warm': {'count': 1", line)
+
+    def test_report_exclusions(self):
+        self.espa.deferred = {}
+        self.framework.agent_exclusions.return_value = {"bad-agent": 300}
+        with self.assertLogs('scheduler', level='INFO') as logs:
+            asyncio.run(self.runtime.report())
+        self.assertTrue(any("Quarantined agents: {'bad-agent': 300}" in l for l in logs.output))
+
+    def test_fetch_priorities(self):
+        cfg = dict(self.cfg)
+        cfg['product_priorities'] = ['high', 'normal']
+        cfg['product_request_count'] = 3
+        self.runtime.cfg = cfg
+        self.espa.get_products_to_process.side_effect = [{"products": [{"orderid": "o1", "scene": "s1"}]},
+                                                         {"products": [{"orderid": "o2", "scene": "s2"}]}]
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 2)
+        calls = self.espa.get_products_to_process.call_args_list
+        self.assertEqual(calls[0][0], (['landsat'], 3))
+        self.assertEqual(calls[0][1], {'priority': 'high'})
+        self.assertEqual(calls[1][0], (['landsat'], 2))
+        self.assertEqual(calls[1][1], {'priority': 'normal'})
+
+    def test_fetch_partitioned(self):
+        self.runtime.coordinator = Mock()
+        self.runtime.coordinator.assigned.return_value = ['modis']
+        asyncio.run(self.runtime.fetch())
+        self.espa.get_products_to_process.assert_called_once_with(['modis'], self.cfg.get('product_request_count'))
+
+        self.runtime.coordinator.assigned.return_value = []
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 0)
+
+    def test_fetch_api_unavailable(self):
+        self.espa.available.return_value = False
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 0)
+        self.espa.mesos_tasks_enabled.assert_not_called()
+        self.assertFalse(asyncio.run(self.runtime.handle_orders()))
+
+    def test_fetch_disabled(self):
+        self.espa.mesos_tasks_enabled.return_value = False
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 0)
+        self.espa.get_products_to_process.assert_not_called()
+
+    def test_fetch_scheduled_error(self):
+        self.espa.set_to_scheduled.side_effect = [True, Exception("boom")]
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 1)
+        # the unit that couldn't be scheduled isn't queued, and is accepted when ESPA hands it out again
+        self.assertEqual(self.framework.workList.get_nowait()["scene"], "s1")
+        self.assertIsNone(self.framework.index.state(("o1", "s2")))
+        self.assertEqual(self.framework.lifecycle.in_flight(), 1)
+
+    def test_handle_orders_triggered(self):
+        cfg = dict(self.cfg)
+        cfg.update(handle_orders_debounce=0, handle_orders_min_seconds=0, handle_orders_burst=3)
+        self.runtime.cfg = cfg
+        self.assertEqual(self.framework.on_units_done, self.runtime.units_done)
+
+        async def run():
+            self.runtime.order_activity("o1", 1, False)
+            self.runtime.order_activity("o1", 1, False)
+            self.assertIsNone(self.runtime.handle_pending)
+            # an order finishing triggers a call, and triggers before it's made share it
+            self.runtime.order_activity("o2", 1, True)
+            self.runtime.order_activity("o1", 1, False)
+            await self.runtime.handle_pending
+            self.assertEqual(self.espa.handle_orders.call_count, 1)
+            self.assertEqual(self.runtime.finished, 0)
+            # a burst of units finishing triggers a call too
+            self.runtime.order_activity("o1", 3, False)
+            await self.runtime.handle_pending
+            self.assertEqual(self.espa.handle_orders.call_count, 2)
+
+        asyncio.run(run())
+
+    def test_handle_orders_order_finished(self):
+        # with the default budget, an order finishing right after a call is handled in well under 420s
+        cfg = dict(self.cfg)
+        cfg.update(handle_orders_debounce=0, handle_orders_min_seconds=0.05)
+        self.runtime.cfg = cfg
+
+        async def run():
+            await self.runtime.handle_orders()
+            called_at = time.monotonic()
+            self.runtime.order_activity("o1", 1, True)
+            await self.runtime.handle_pending
+            self.assertEqual(self.espa.handle_orders.call_count, 2)
+            return self.runtime.handled_at - called_at
+
+        self.assertLess(asyncio.run(run()), 1)
+
+    def test_handle_orders_budget(self):
+        cfg = dict(self.cfg)
+        cfg.update(handle_orders_debounce=0, handle_orders_min_seconds=0)
+        self.runtime.cfg = cfg
+        self.runtime.handle_budget = TokenBucket(0.3, 1)
+
+        async def run():
+            await self.runtime.handle_orders()
+            called_at = time.monotonic()
+            # no budget left, the fallback is skipped and a triggered call waits for a token
+            self.runtime.handled_at = None
+            self.assertFalse(await self.runtime.fallback_handle_orders())
+            self.runtime.trigger_handle_orders()
+            await self.runtime.handle_pending
+            self.assertEqual(self.espa.handle_orders.call_count, 2)
+            return self.runtime.handled_at - called_at
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.25)
+
+    def test_handle_orders_spacing(self):
+        cfg = dict(self.cfg)
+        cfg.update(handle_orders_debounce=0, handle_orders_min_seconds=0.1)
+        self.runtime.cfg = cfg
+
+        async def run():
+            await self.runtime.handle_orders()
+            self.runtime.trigger_handle_orders()
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.espa.handle_orders.call_count, 1)
+            await self.runtime.handle_pending
+            self.assertEqual(self.espa.handle_orders.call_count, 2)
+            # the periodic fallback is skipped after a recent call
+            self.assertFalse(await self.runtime.fallback_handle_orders())
+            self.assertEqual(self.espa.handle_orders.call_count, 2)
+
+        asyncio.run(run())
+
+    def test_startup(self):
+        cfg = dict(self.cfg)
+        cfg['product_request_count'] = 50
+        cfg['espa_api_concurrency'] = 16
+        self.framework.client = SlowClient()
+        runtime = Runtime(cfg, slow_api(), self.framework)
+
+        async def stop_soon():
+            while runtime.first_fetch is None:
+                await asyncio.sleep(0.01)
+            runtime.stop()
+
+        async def run():
+            await asyncio.gather(runtime.run(), stop_soon())
+
+        asyncio.run(asyncio.wait_for(run(), 5))
+        # subscribing doesn't wait on the API, and units are marked scheduled concurrently
+        self.assertLess(self.framework.client.registered_at - runtime.created_at, 0.1)
+        self.assertGreaterEqual(runtime.first_fetch, 0.3)
+        self.assertLess(runtime.first_fetch, 0.3 + 50 * 0.05)
+        self.assertEqual(runtime.drain_progress["queued"], 50)
+
+    def test_drain(self):
+        asyncio.run(self.runtime.fetch())
+        self.espa.mesos_tasks_enabled.return_value = False
+        self.espa.update_status.side_effect = [{"status": 200}, Exception("boom")]
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 0)
+
+        self.assertEqual(self.runtime.drain_progress, {"reason": "mesos tasks disabled", "queued": 2, "returned": 1,
+                                                       "failed": 1, "deferred": 0, "tasks": 0})
+        self.espa.update_status.assert_any_call("s1", "o1", "submitted")
+        # the unit that couldn't be returned stays queued, the returned one can be fetched again
+        self.assertEqual(self.framework.workList.qsize(), 1)
+        self.assertEqual(self.framework.index.metrics()["units"], {"queued": 1})
+
+    def test_no_drain_unknown(self):
+        asyncio.run(self.runtime.fetch())
+        # a failed run_mesos_tasks lookup skips the cycle, and keeps the queue
+        self.espa.mesos_tasks_enabled.return_value = None
+        self.assertEqual(asyncio.run(self.runtime.fetch()), 0)
+        self.assertEqual(self.framework.workList.qsize(), 2)
+        self.espa.update_status.assert_not_called()
+        self.assertIsNone(self.runtime.drain_progress)
+
+    def test_drain_batches(self):
+        cfg = dict(self.cfg)
+        cfg['drain_batch_size'] = 2
+        self.runtime.cfg = cfg
+        for i in range(5):
+            self.framework.workList.put_nowait({"orderid": "o1", "scene": "s{}".format(i)})
+        self.framework.retryList.append((0, {"orderid": "o2", "scene": "s1"}))
+        self.espa.update_status.return_value = {"status": "deferred"}
+
+        progress = asyncio.run(self.runtime.drain("test"))
+        self.assertEqual(progress["queued"], 6)
+        self.assertEqual(progress["deferred"], 6)
+        self.assertEqual(self.espa.update_status.call_count, 6)
+
+    def test_drain_waits_for_tasks(self):
+        self.framework.taskedList = {"o1_@@@_s1": [{"orderid": "o1", "scene": "s1"}]}
+
+        async def finish_soon():
+            await asyncio.sleep(0.1)
+            self.framework.taskedList.clear()
+
+        async def run():
+            progress, _ = await asyncio.gather(self.runtime.drain("test", timeout=5), finish_soon())
+            return progress
+
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(run())["tasks"], 0)
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_watch(self):
+        self.runtime.settings = Mock()
+        self.runtime.settings.changed_on_disk.return_value = False
+        asyncio.run(self.runtime.watch())
+        self.runtime.settings.reload.assert_not_called()
+
+        self.runtime.settings.changed_on_disk.return_value = True
+        asyncio.run(self.runtime.watch())
+        self.runtime.settings.reload.assert_called_once()
+
+    def test_reconfigure(self):
+        cfg = dict(self.cfg)
+        cfg['api_reset_seconds'] = 5
+        cfg['api_timeout_seconds'] = 12
+        self.runtime.reconfigure(cfg)
+        self.assertIs(self.runtime.cfg, cfg)
+        self.assertEqual(self.espa.breaker.reset_seconds, 5)
+        self.assertEqual(self.espa.timeout, 12)
+
+    def test_run_stop(self):
+        async def stop_soon():
+            while self.runtime.stopping is None or not self.espa.handle_orders.called:
+                await asyncio.sleep(0.01)
+            self.runtime.stop()
+
+        async def run():
+            await asyncio.gather(self.runtime.run(), stop_soon())
+
+        asyncio.run(asyncio.wait_for(run(), 5))
+        self.assertTrue(self.framework.client.stopped.is_set())
+        # queued units are handed back to ESPA on shutdown
+        self.framework.start_draining.assert_called_once()
+        self.assertEqual(self.runtime.drain_progress["queued"], 2)
+        self.assertEqual(self.framework.workList.qsize(), 0)
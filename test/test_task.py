@@ -59,6 +59,21 @@ class TestTask(unittest.TestCase):
         expected = 'python /src/processing/main.py \'[{"foo":1}]\''
         self.assertEqual(command, expected)
 
+    def test_command_batch(self):
+        command = task.command([{"foo": 1}, {"foo": 2}])
+        expected = 'python /src/processing/main.py \'[{"foo":1},{"foo":2}]\''
+        self.assertEqual(command, expected)
+
+    def test_task_id(self):
+        self.assertEqual(task.task_id("espa-1", ["s1"]), "espa-1_@@@_s1")
+        self.assertEqual(task.task_id("espa-1", ["s1", "s2"]), "espa-1_@@@_s1_+++_s2")
+        self.assertEqual(task.decode_id("espa-1_@@@_s1"), ("espa-1", ["s1"]))
+        self.assertEqual(task.decode_id("espa-1_@@@_s1_+++_s2"), ("espa-1", ["s1", "s2"]))
+        self.assertEqual(task.task_id("espa-1", ["s1", "s2"], 2), "espa-1_@@@_s1_+++_s2_###_2")
+        self.assertEqual(task.decode_id("espa-1_@@@_s1_+++_s2_###_2"), ("espa-1", ["s1", "s2"]))
+        self.assertEqual(task.decode_attempt("espa-1_@@@_s1_+++_s2_###_2"), 2)
+        self.assertEqual(task.decode_attempt("espa-1_@@@_s1"), 0)
+
     def test_build(self):
         offer = Dict()
         offer.agent_id.value = "999"
@@ -16,3 +16,21 @@ class TestUtil(unittest.TestCase):
         rightnow = util.right_now()
         match = re.match("[0-9]{2}-[0-9]{2}-[0-9]{4}:[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{6}", rightnow)
         self.assertEqual(match.string, rightnow)
+
+    def test_rotate(self):
+        items = ['landsat', 'modis', 'plot']
+        self.assertEqual(util.rotate(items), 'landsat')
+        self.assertEqual(items, ['modis', 'plot', 'landsat'])
+
+    def test_token_bucket(self):
+        bucket = util.TokenBucket(420, capacity=2)
+        self.assertTrue(bucket.take(now=0))
+        self.assertTrue(bucket.take(now=1))
+        self.assertFalse(bucket.take(now=2))
+        self.assertAlmostEqual(bucket.wait(now=2), 418)
+        self.assertTrue(bucket.take(now=421))
+        # refills no higher than capacity
+        self.assertEqual(bucket.wait(now=10000), 0)
+        self.assertTrue(bucket.take(now=10000))
+        self.assertTrue(bucket.take(now=10000))
+        self.assertFalse(bucket.take(now=10000))